@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# parser benchmarks, on synthetic TRM dumps so they don't need the real
+# (multi-hundred MB) part XMLs
+#
+#   python3 bench-parser.py [--sizes 50,200,800] [--keep <dir>]
+#
+# every measurement runs in a fresh process, so peak RSS is just that stage
+from parse_rk_trm import Parser, peak_rss
+from xml.sax.saxutils import escape
+import concurrent.futures
+import multiprocessing
+import importlib.util
+import argparse
+import resource
+import tempfile
+import random
+import shutil
+import time
+import sys
+import os
+
+# columns, as pdftohtml would put them
+NAME_COL = 100
+ROW_COL = 300
+SUM_DESC_COL = 500
+BIT_COL = 110
+DESC_COL = 420
+
+PART1_BLOCKS = ['CRU', 'GRF', 'UART', 'I2S', 'WDT']
+PART2_BLOCKS = ['PMUCRU', 'PMUGRF', 'SPI', 'CIC']
+
+def text (font, left, body, bold=None):
+	inner = ''
+	if bold is not None:
+		inner = ''.join ('<b>%s</b>' % escape (x) for x in bold)
+	if body:
+		inner += escape (body)
+
+	return '<text top="0" left="%d" width="10" height="10" font="%s">%s</text>' % (left, font, inner)
+
+def italic (font, body):
+	return '<text top="0" left="50" width="10" height="10" font="%s"><i>%s</i></text>' % (font, escape (body))
+
+# a pdftohtml -xml style document, a page of <text> elements at a time
+class SyntheticTRM (object):
+	def __init__ (self, per_page=40):
+		self.per_page = per_page
+		self.pages = []
+
+		# <text> elements, counting each page's header and footer
+		self.elements = 0
+
+		self.new_page ()
+
+	def new_page (self):
+		self.pages.append ([text ('0', 50, 'RK3399 TRM')])
+		self.elements += 2
+
+	def emit (self, line):
+		if len(self.pages[-1]) >= self.per_page:
+			self.new_page ()
+
+		self.pages[-1].append (line)
+		self.elements += 1
+
+	def render (self):
+		out = [
+			'<?xml version="1.0" encoding="UTF-8"?>',
+			'<pdf2xml producer="poppler" version="0.41.0">'
+		]
+
+		for (i, lines) in enumerate (self.pages):
+			number = i + 1
+			out.append ('<page number="%d" position="absolute" top="0" left="0" height="1263" width="892">' % number)
+			out.append ('\t<fontspec id="0" size="8" family="Times" color="#000000"/>')
+			out += lines
+			out.append (italic ('1', 'Copyright 2017 @ FuZhou Rockchip Electronics Co., Ltd. %d' % number))
+			out.append ('</page>')
+
+		out.append ('</pdf2xml>')
+		return '\n'.join (out) + '\n'
+
+def make_block (prefix, nregs, rnd):
+	# [(name, offset, [(hi, lo)])]; every tenth register is a ranged one,
+	# or one with a name too long for its column
+	regs = []
+	for i in range (nregs):
+		name = '%s_REG%d' % (prefix, i)
+		if i % 10 == 3:
+			name = '%s_%s%d' % (prefix, ['RNG', 'TIL', 'LONGNAME'][(i // 10) % 3], i)
+
+		bits = []
+		hi = 31
+		while hi >= 0:
+			lo = max (0, hi - rnd.choice ([0, 3, 7, 15]))
+			bits.append ((hi, lo))
+			hi = lo - 1
+
+		regs.append ((name, i * 4, bits))
+
+	return regs
+
+def emit_summary (doc, regs, rnd, section):
+	doc.emit (text ('14', 50, None, ['%d.1 Registers Summary' % section]))
+	doc.emit (text ('5', NAME_COL, None, ['Name']))
+
+	# all the ways the heading row gets split up
+	layout = rnd.randrange (4)
+	if layout == 0:
+		doc.emit (text ('5', ROW_COL, None, ['Offset Size Reset']))
+		doc.emit (text ('5', ROW_COL, None, ['Value']))
+	elif layout == 1:
+		doc.emit (text ('5', ROW_COL, None, ['Offset Size']))
+		doc.emit (text ('5', ROW_COL, None, ['Reset']))
+	elif layout == 2:
+		doc.emit (text ('5', ROW_COL, None, ['Offset']))
+		doc.emit (text ('5', ROW_COL, None, ['Size Reset Value']))
+	else:
+		doc.emit (text ('5', ROW_COL, None, ['Offset', 'Size', 'Reset Value']))
+	doc.emit (text ('5', SUM_DESC_COL, None, ['Description']))
+
+	for (name, offset, bits) in regs:
+		if '_RNG' in name:
+			# 0x0010~ / 0x001c
+			doc.emit (text ('3', NAME_COL, name))
+			doc.emit (text ('3', ROW_COL, '0x%04x~' % offset))
+			doc.emit (text ('3', ROW_COL, '0x%04x' % (offset + 12)))
+			doc.emit (text ('3', ROW_COL, 'W 0x00000000 ranged register'))
+			continue
+		elif '_TIL' in name:
+			# 0x0010 / ~0x001c
+			doc.emit (text ('3', NAME_COL, name))
+			doc.emit (text ('3', ROW_COL, '0x%04x' % offset))
+			doc.emit (text ('3', ROW_COL, '~0x%04x' % (offset + 12)))
+			doc.emit (text ('3', ROW_COL, 'W 0x00000000 tilde register'))
+			continue
+		elif '_LONGNAME' in name:
+			doc.emit (text ('3', NAME_COL, name[:-4]))
+			doc.emit (text ('3', NAME_COL, name[-4:]))
+			doc.emit (text ('3', ROW_COL, '0x%04x W 0x00000000 clipped name' % offset))
+			continue
+
+		row = rnd.randrange (3)
+		if row == 0:
+			doc.emit (text ('3', NAME_COL, '%s 0x%04x W 0x00000000 %s config' % (name, offset, name.lower ())))
+		elif row == 1:
+			# description carries on in its own column
+			doc.emit (text ('3', NAME_COL, name))
+			doc.emit (text ('3', ROW_COL, '0x%04x W 0x00000000' % offset))
+			doc.emit (text ('3', SUM_DESC_COL, '%s register' % name.lower ()))
+			doc.emit (text ('3', SUM_DESC_COL, 'continued description'))
+		else:
+			doc.emit (text ('3', NAME_COL, name))
+			doc.emit (text ('3', ROW_COL, '0x%04x' % offset))
+			doc.emit (text ('3', ROW_COL, 'W 0x00000000 %s split row' % name.lower ()))
+
+	doc.emit (italic ('1', 'Notes: Size : B- Byte (8 bits) access'))
+
+def emit_detail (doc, regs, rnd, section):
+	doc.emit (text ('14', 50, None, ['%d.2 Detail Register Description' % section]))
+
+	for (name, offset, bits) in regs:
+		doc.emit (text ('5', NAME_COL, None, [name]))
+		if '_RNG' in name or '_TIL' in name:
+			doc.emit (text ('3', NAME_COL, 'Address: Operational Base + offset (0x%04x~0x%04x)' % (offset, offset + 12)))
+		elif rnd.randrange (4) == 0:
+			doc.emit (text ('3', NAME_COL, 'Address: Operational Base+0x%04x' % offset))
+		else:
+			doc.emit (text ('3', NAME_COL, 'Address: Operational Base + offset (0x%04x)' % offset))
+
+		doc.emit (text ('3', NAME_COL, '%s register' % name.lower ()))
+		if rnd.randrange (3) == 0:
+			doc.emit (text ('3', NAME_COL, 'with a longer description'))
+
+		layout = rnd.randrange (3)
+		if layout == 0:
+			doc.emit (text ('5', BIT_COL, None, ['Bit', 'Attr', 'Reset Value']))
+		elif layout == 1:
+			doc.emit (text ('5', BIT_COL, None, ['Bit']))
+			doc.emit (text ('5', BIT_COL, None, ['Attr', 'Reset Value']))
+		else:
+			doc.emit (text ('5', BIT_COL, None, ['Bit', 'Attr']))
+			doc.emit (text ('5', BIT_COL, None, ['Reset Value']))
+		doc.emit (text ('5', DESC_COL, None, ['Description']))
+
+		for (hi, lo) in bits:
+			bit_range = '%d:%d' % (hi, lo) if hi != lo else '%d' % hi
+
+			if rnd.randrange (10) == 0:
+				# table heading repeated at the top of a new page
+				doc.emit (text ('5', BIT_COL, None, ['Bit', 'Attr', 'Reset Value']))
+				doc.emit (text ('5', DESC_COL, None, ['Description']))
+
+			row = rnd.randrange (6)
+			if row == 0:
+				doc.emit (text ('3', BIT_COL, '%s RW 0x0' % bit_range))
+			elif row == 1:
+				doc.emit (text ('3', BIT_COL, bit_range))
+				doc.emit (text ('3', BIT_COL + 40, 'RO 0x0'))
+			elif row == 2:
+				doc.emit (text ('3', BIT_COL, bit_range))
+				doc.emit (text ('3', BIT_COL + 40, 'RW'))
+				doc.emit (text ('3', BIT_COL + 60, '0x0'))
+			elif row == 3:
+				# W1C split over two lines
+				doc.emit (text ('3', BIT_COL, bit_range))
+				doc.emit (text ('3', BIT_COL + 40, 'W1'))
+				doc.emit (text ('3', BIT_COL + 40, 'C 0x0'))
+			elif row == 4:
+				# self clearing
+				doc.emit (text ('3', BIT_COL, '%s RW' % bit_range))
+				doc.emit (text ('3', BIT_COL + 60, 'SC'))
+				doc.emit (text ('3', BIT_COL + 60, '0x0'))
+			else:
+				doc.emit (text ('3', BIT_COL, '%s RU 0x1' % bit_range))
+
+			field = 'f_%d_%d' % (hi, lo)
+			doc.emit (text ('3', DESC_COL, field))
+			doc.emit (text ('3', DESC_COL, 'field %s of %s' % (field, name)))
+			if rnd.randrange (2):
+				doc.emit (text ('3', DESC_COL, "    2'b01: mode one"))
+
+		doc.emit (text ('3', 20, ' '))
+
+def generate (blocks, nregs, seed=0):
+	# returns (xml, number of <text> elements)
+	rnd = random.Random (seed)
+	doc = SyntheticTRM ()
+
+	for (i, prefix) in enumerate (blocks):
+		regs = make_block (prefix, nregs, rnd)
+		emit_summary (doc, regs, rnd, i + 1)
+		emit_detail (doc, regs, rnd, i + 1)
+
+	return (doc.render (), doc.elements)
+
+def load_gen_svd ():
+	# it's a script (with a dash in its name), not a module
+	path = os.path.join (os.path.dirname (os.path.abspath (__file__)), 'gen-svd.py')
+	spec = importlib.util.spec_from_file_location ('gen_svd', path)
+	module = importlib.util.module_from_spec (spec)
+	spec.loader.exec_module (module)
+	return module
+
+def quiet ():
+	# the parser and builder are chatty, and the numbers are what we're after
+	devnull = os.open (os.devnull, os.O_WRONLY)
+	os.dup2 (devnull, 1)
+
+def bench_parse (parts):
+	quiet ()
+	started = time.time ()
+
+	p = Parser ()
+	for part in parts:
+		with open (part, 'rb') as f:
+			p.parse (f)
+
+	return (time.time () - started, peak_rss ())
+
+def bench_check (parts):
+	quiet ()
+	p = Parser ()
+	for part in parts:
+		with open (part, 'rb') as f:
+			p.parse (f)
+
+	started = time.time ()
+	p.check ()
+
+	return (time.time () - started, peak_rss ())
+
+def bench_load_datasheet (parts):
+	quiet ()
+
+	# Builder wants data/ relative to the repo
+	os.chdir (os.path.dirname (os.path.abspath (__file__)))
+	gen_svd = load_gen_svd ()
+
+	timing = {}
+	class Builder (gen_svd.Builder):
+		def load_datasheet (self):
+			# next to the synthetic parts, not over the last real run's
+			self.diagnostics_report = os.path.join (os.path.dirname (parts[0]), 'parse-diagnostics.json')
+
+			started = time.time ()
+			super (Builder, self).load_datasheet ()
+			timing['elapsed'] = time.time () - started
+
+	Builder ('AP', cache=False, keep_going=True, parts=parts)
+
+	# the parts get parsed in their own processes
+	children = resource.getrusage (resource.RUSAGE_CHILDREN).ru_maxrss
+	return (timing['elapsed'], max (peak_rss (), children))
+
+# (name, function, whether it goes through the elements)
+STAGES = [
+	('Parser.parse', bench_parse, True),
+	('Parser.check', bench_check, False),
+	('Builder.load_datasheet', bench_load_datasheet, True),
+]
+
+def run (stage, parts):
+	ctx = multiprocessing.get_context ('spawn')
+	with concurrent.futures.ProcessPoolExecutor (1, mp_context=ctx) as pool:
+		return pool.submit (stage, parts).result ()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser ()
+	parser.add_argument ('--sizes', default='50,200,800',
+		help='registers per block, comma separated (default: %(default)s)')
+	parser.add_argument ('--keep', metavar='DIR',
+		help='write the synthetic parts to DIR and leave them there')
+	args = parser.parse_args ()
+
+	sizes = [int(x) for x in args.sizes.split (',')]
+	outdir = args.keep or tempfile.mkdtemp (prefix='bench-parser-')
+	if not os.path.exists (outdir):
+		os.makedirs (outdir)
+
+	print('%8s %10s %10s  %-24s %9s %14s %14s' % (
+		'regs', 'elements', 'MB', 'stage', 'time (s)', 'elements/sec', 'peak RSS (KiB)'))
+
+	try:
+		for size in sizes:
+			parts = []
+			elements = 0
+			nbytes = 0
+			for (i, blocks) in enumerate ([PART1_BLOCKS, PART2_BLOCKS]):
+				(xml, n) = generate (blocks, size, seed=i + 1)
+				fname = os.path.join (outdir, 'synthetic-%d-part%d.xml' % (size, i + 1))
+				with open (fname, 'w') as f:
+					f.write (xml)
+
+				parts.append (os.path.abspath (fname))
+				elements += n
+				nbytes += len(xml)
+
+			for (name, stage, per_element) in STAGES:
+				(elapsed, rss) = run (stage, parts)
+				rate = '%d' % (elements / max (elapsed, 1e-6)) if per_element else '-'
+				print('%8d %10d %10.1f  %-24s %9.3f %14s %14d' % (
+					size * (len(PART1_BLOCKS) + len(PART2_BLOCKS)), elements, nbytes / 1e6,
+					name, elapsed, rate, rss))
+				sys.stdout.flush ()
+	finally:
+		if not args.keep:
+			shutil.rmtree (outdir)
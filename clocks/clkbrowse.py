@@ -5,8 +5,7 @@ import pickle
 
 from werkzeug.local import LocalProxy
 from clktool import RustClockManager
-from clocks import Clock, Gate, Divider, Mux, Frac, FixedDivider, \
-    DisconnectedClockException
+from clocks import Clock, Gate, Divider, Mux, Frac, FixedDivider
 
 class ClockJSONEncoder(JSONEncoder):
     def default(self, obj):
@@ -18,10 +17,8 @@ class ClockJSONEncoder(JSONEncoder):
                 'parents': [x.clk_id for x in obj.parents]
             }
 
-            try:
-                d['clk'] = obj.clk
-            except DisconnectedClockException:
-                d['clk'] = None
+            # from the last compute_all
+            d['clk'], d['enabled'] = clockman.rates[obj.clk_id]
 
             for child in ('divider', 'frac', 'gate', 'mux'):
                 childval = obj.__dict__[child]
@@ -83,6 +80,7 @@ clockman = load_clockman()
 
 @app.route('/clocks/all')
 def all_clocks():
+    clockman.compute_all()
     return jsonify(list(clockman.clocks.values()))
 
 @app.route('/clocks/<clkname>', methods=('GET', 'POST'))
@@ -98,8 +96,10 @@ def clock(clkname):
         # mutate back?
         clockman.clocks_by_name[clkname] = clock
 
+        clockman.compute_all()
         return jsonify(clock)
     else:
+        clockman.compute_all()
         return jsonify(clockman.clocks_by_name[clkname])
 
 @app.route('/state/dump/<fname>')
@@ -20,6 +20,10 @@ class ClockManager(object):
 
         self.RUST_PERIPHERALS = ['cru', 'pmucru', 'grf', 'pmugrf']
 
+        # see compute_all
+        self.clock_order = None
+        self.rates = {}
+
     def load_clock(self, clock, clock_info):
         # one would only expect mux iff parents > 1
         # likewise, if > 1 parent, must be mux
@@ -33,7 +37,7 @@ class ClockManager(object):
         if clock_info['gate']:
             clock.gate = []
             for reg in extract_registers(clock_info['gate']):
-                clock.gate.append (Gate(reg))
+                clock.gate.append (Gate(reg, clock))
 
         # shouldn't be both divider and fractional divider
         assert not (clock_info['div'] and clock_info['frac'])
@@ -117,6 +121,55 @@ class ClockManager(object):
 
                 clock.mux = Mux(mux_reg, clock, clock.parents)
 
+        # so a change to one clock can invalidate the cached rates of
+        # everything downstream of it
+        for clock in self.clocks.values():
+            for src in set(clock.sources):
+                src.children.append(clock)
+
+    def topological_order(self):
+        # every clock after the clocks its rate depends on, starting from
+        # the fixed clocks
+        waiting = dict((clock.clk_id, len(set(clock.sources))) for clock in self.clocks.values())
+        ready = sorted(x for x in waiting if waiting[x] == 0)
+        order = []
+
+        while ready:
+            clock = self.clocks[ready.pop()]
+            order.append(clock)
+
+            for child in clock.children:
+                waiting[child.clk_id] -= 1
+                if waiting[child.clk_id] == 0:
+                    ready.append(child.clk_id)
+
+        if len(order) != len(self.clocks):
+            # a loop through some muxes; they still work out, just by
+            # recursing like they would on their own
+            looped = [x for x in self.clocks.values() if waiting[x.clk_id] > 0]
+            print('WARNING: clocks depend on each other:', looped)
+            order += looped
+
+        return order
+
+    def compute_all(self):
+        # every clock's (rate, enabled) by clk_id, in one pass over the
+        # tree; clocks that haven't changed since last time are cached
+        # (see Clock.invalidate), so polling this is cheap
+        if self.clock_order is None:
+            self.clock_order = self.topological_order()
+
+        self.rates = {}
+        for clock in self.clock_order:
+            try:
+                rate = clock.clk
+            except DisconnectedClockException:
+                rate = None
+
+            self.rates[clock.clk_id] = (rate, clock.enabled)
+
+        return self.rates
+
     def gen_dump_regs(self, clock, dumpname, reg, level):
         indent = '    '
         print_indent = '\\t' * level
@@ -153,8 +206,16 @@ class RustClockManager(ClockManager):
             svd_regs = {}
 
             if 'derivedFrom' in peripheral.attrib:
-                # use existing as base
-                svd_regs.update(svd_peripherals[peripheral.attrib['derivedFrom'].lower()])
+                base = svd_peripherals[peripheral.attrib['derivedFrom'].lower()]
+                if peripheral.find('registers') is None:
+                    # same block as the one it's derived from (gen-svd only
+                    # ever does this); share its registers rather than
+                    # copying them for every instance. so don't modify them!
+                    svd_peripherals[peripheral_rustname] = base
+                    continue
+
+                # use existing as base, and add/override with its own
+                svd_regs.update(base)
 
             for reg in peripheral.iter('register'):
                 reg_rustname = reg.find('name').text.lower()
@@ -180,12 +241,29 @@ class RustClockManager(ClockManager):
                     # but will need to change the "name" fields in it
                     fields[name] = parsed_bits
 
-                svd_regs[reg_rustname] = fields
+                # arrays (gen-svd.py --fold-arrays) are looked up by the
+                # names of the registers they were folded from
+                for name in self.dim_names(reg, reg_rustname):
+                    svd_regs[name] = fields
 
             svd_peripherals[peripheral_rustname] = svd_regs
 
         return svd_peripherals
 
+    def dim_names(self, reg, name):
+        if reg.find('dim') is None:
+            return [name]
+
+        dim_index = reg.find('dimIndex').text
+        m = re.match('(\d+)-(\d+)$', dim_index)
+        if m:
+            indexes = range(int(m.group(1)), int(m.group(2)) + 1)
+        else:
+            indexes = dim_index.split(',')
+
+        assert len(indexes) == int(reg.find('dim').text)
+        return [name.replace('%s', str(i).lower()) for i in indexes]
+
     def get_write_reg(self, clock, dumpname, reg, level, displayname):
         assert not isinstance(reg, list)
 
@@ -393,7 +471,7 @@ pub fn print_clocks() {
             current_clk.register_map[regmap_name].to_obj(val)
         else:
             # just direct set on object in class; doesn't have a deserialisation function
-            current_clk.__dict__[regmap_name] = val
+            setattr(current_clk, regmap_name, val)
 
     def load_dump(self, f):
         current_clk_name = None
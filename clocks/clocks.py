@@ -4,7 +4,26 @@ from json import JSONEncoder, JSONDecoder
 class DisconnectedClockException(Exception):
     pass
 
-class Divider(object):
+class Parameters(object):
+    # attributes that go into a clock's rate; setting any of them
+    # throws away the cached rates of the clock it belongs to and
+    # everything downstream of it (see Clock.invalidate)
+    parameters = ()
+
+    def __setattr__(self, name, value):
+        super(Parameters, self).__setattr__(name, value)
+
+        if name in self.parameters:
+            self.changed()
+
+    def changed(self):
+        owner = self.__dict__.get('owner')
+        if owner is not None:
+            owner.invalidate()
+
+class Divider(Parameters):
+    parameters = ('div',)
+
     def __init__(self, reg, owner, value=None):
         super(Divider, self).__init__()
 
@@ -69,7 +88,9 @@ class FixedDivider(Divider):
     def __repr__(self):
         return '/ %df' % self.div
 
-class Frac(object):
+class Frac(Parameters):
+    parameters = ('numerator', 'denominator')
+
     def __init__(self, reg, owner, value=None):
         super(Frac, self).__init__()
 
@@ -113,14 +134,17 @@ class Frac(object):
     def __repr__(self):
         return '* %d/%d' % (self.numerator, self.denominator)
 
-class Gate(object):
-    def __init__(self, reg, value=None):
+class Gate(Parameters):
+    parameters = ('clocking_enabled',)
+
+    def __init__(self, reg, owner, value=None):
         super(Gate, self).__init__()
 
         reg.from_obj = self.reg_value
         reg.to_obj = self.from_reg_value
         self.reg = reg
 
+        self.owner = owner
         self.clocking_enabled = None
 
         if value:
@@ -146,7 +170,9 @@ class Gate(object):
     def __repr__(self):
         return 'G=%s' % (self.clocking_enabled)
 
-class Mux(object):
+class Mux(Parameters):
+    parameters = ('clk_src',)
+
     def __init__(self, reg, owner, clocks, value=None):
         super(Mux, self).__init__()
 
@@ -191,7 +217,7 @@ class Mux(object):
         else:
             return 'M=? (%s)' % (self.clocks)
 
-class Clock(object):
+class Clock(Parameters):
     def __init__(self, clk_id, name, module):
         super(Clock, self).__init__()
         self.clk_id = clk_id
@@ -205,6 +231,37 @@ class Clock(object):
 
         self.parents = []
 
+        # clocks whose rate depends on ours; see ClockManager.load
+        self.children = []
+
+        # our rate, until invalidate() says otherwise
+        self.clk_cache = None
+        self.clk_valid = False
+
+    def changed(self):
+        self.invalidate()
+
+    def invalidate(self):
+        # anything downstream that's still cached was worked out from our
+        # (cached) rate, so we can stop wherever there's nothing cached
+        stack = [self]
+        while stack:
+            clock = stack.pop()
+            clock.clk_valid = False
+            clock.clk_cache = None
+
+            stack.extend(x for x in clock.children if x.clk_valid)
+
+    @property
+    def sources(self):
+        # the clocks our rate can depend on
+        return self.parents
+
+    @property
+    def enabled(self):
+        # whether our own gates let the clock through, whatever's upstream
+        return not self.gate or all(g.clocking_enabled != False for g in self.gate)
+
     @property
     def register_map(self):
         return {}
@@ -221,10 +278,17 @@ class Clock(object):
             return self.parents[0]
 
     @property
+    def clk(self):
+        if not self.clk_valid:
+            self.clk_cache = self.rate()
+            self.clk_valid = True
+
+        return self.clk_cache
+
     # FIXME: makes a big assumption that the clock is enabled
     # if at least one of the gates are powered, rather than
     # some boolean condition on the state of the gates
-    def clk(self):
+    def rate(self):
         # print self,
         if self.gate:
             for g in self.gate:
@@ -262,12 +326,13 @@ class Clock(object):
         return '%s (%d)' % (self.name, self.clk_id)
 
 class FixedClock(Clock):
+    parameters = ('clk_rate',)
+
     def __init__(self, clk_id, name, module, clk):
         super(FixedClock, self).__init__(clk_id, name, module)
         self.clk_rate = clk
 
-    @property
-    def clk(self):
+    def rate(self):
         # print self,
         return self.clk_rate
 
@@ -280,6 +345,9 @@ class FixedClock(Clock):
         return {}
 
 class PLL(Clock):
+    parameters = ('fbdiv', 'refdiv', 'fracdiv', 'dsmpd', 'postdiv1', 'postdiv2',
+        'selected_clk_idx', 'power_down', 'bypass')
+
     def __init__(self, clk_id, name, module, fixed_24mhz, fixed_32khz):
         super(PLL, self).__init__(clk_id, name, module)
         self.fbdiv = None
@@ -303,6 +371,14 @@ class PLL(Clock):
     def register_children(self):
         return []
 
+    @property
+    def sources(self):
+        return self.parents + [x for x in self.pll_work_mode if x is not self]
+
+    @property
+    def enabled(self):
+        return not self.power_down
+
     @property
     def register_map(self):
         reg_basename = 'CRU'
@@ -355,8 +431,7 @@ class PLL(Clock):
         """Fractional PLL divided output frequency (output of second post divider)"""
         return self.foutvco / self.postdiv1 / self.postdiv2
 
-    @property
-    def clk(self):
+    def rate(self):
         if self.selected_clk_idx is None:
             print(self, 'has invalid PLL_WORK_MODE')
 
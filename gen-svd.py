@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 from parse_rk_trm import *
+from regcache import Cache
+import regdb
+import parse_rk_trm
 import lxml.etree as ET
 import re
 
@@ -7,6 +10,107 @@ import sys
 import os
 import json
 import pycparser
+import concurrent.futures
+import argparse
+import copy
+import multiprocessing
+import time
+import bisect
+import functools
+import glob
+
+# left out of made up field names
+FIELD_NAME_FILLER = set([
+	'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'if', 'in',
+	'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'when', 'which',
+	'will', 'with'
+])
+
+# addresses in the peripheral map: names of other entries, hex (0x..., or
+# with a _ in it, as the TRM writes them: FF76_0000), decimal, + - * and
+# brackets
+ADDRESS_TOKEN_RE = re.compile ('\s*(?:([0-9A-Za-z_]+)|(\S))')
+
+@functools.lru_cache (maxsize=None)
+def parse_address (text):
+	# text -> a tree of (op, left, right) and ('word', word)
+	tokens = [m.group(1) or m.group(2) for m in ADDRESS_TOKEN_RE.finditer (text.strip ())]
+	pos = 0
+
+	def take (expected=None):
+		nonlocal pos
+		if pos == len(tokens) or (expected is not None and tokens[pos] != expected):
+			raise ValueError ('bad address %r' % text)
+
+		pos += 1
+		return tokens[pos - 1]
+
+	def atom ():
+		token = take ()
+		if token == '(':
+			tree = expression ()
+			take (')')
+			return tree
+
+		if not re.match ('[0-9A-Za-z_]+$', token):
+			raise ValueError ('bad address %r' % text)
+
+		return ('word', token)
+
+	def term ():
+		tree = atom ()
+		while pos < len(tokens) and tokens[pos] == '*':
+			tree = (take (), tree, atom ())
+
+		return tree
+
+	def expression ():
+		tree = term ()
+		while pos < len(tokens) and tokens[pos] in '+-':
+			tree = (take (), tree, term ())
+
+		return tree
+
+	tree = expression ()
+	if pos != len(tokens):
+		raise ValueError ('bad address %r' % text)
+
+	return tree
+
+@functools.lru_cache (maxsize=None)
+def address_literal (word):
+	if re.match ('0[xX][0-9A-Fa-f_]+$', word):
+		return int(word[2:].replace ('_', ''), 16)
+
+	if '_' in word and re.match ('[0-9A-Fa-f_]+$', word):
+		return int(word.replace ('_', ''), 16)
+
+	if word.isdigit ():
+		return int(word)
+
+	return None
+
+def eval_address (tree, lookup):
+	# lookup: name -> address, or None if it's not a name
+	if tree[0] == 'word':
+		value = lookup (tree[1])
+		if value is None:
+			value = address_literal (tree[1])
+
+		if value is None:
+			raise ValueError ('unknown name %s in address' % tree[1])
+
+		return value
+
+	(op, left, right) = tree
+	left = eval_address (left, lookup)
+	right = eval_address (right, lookup)
+	if op == '+':
+		return left + right
+	elif op == '-':
+		return left - right
+
+	return left * right
 
 class PeripheralMap (object):
 	def __init__ (self, name, base_addr, block=None):
@@ -25,52 +129,342 @@ class PeripheralMap (object):
 	def __repr__ (self):
 		return '%s@0x%8x' % (self.name, self.base_addr)
 
-class Builder (object):
-	def __init__ (self, name):
-		self.p = Parser()
-		self.name = name
-		self.map = {}
-		self.addrmap = {}
-		self.addrmap_noremap = {}
+# every register of every mapped peripheral, by address
+class AddressInterval (object):
+	def __init__ (self, start, end, per, reg, element=0):
+		self.start = start
+		self.end = end
+		self.per = per
+		self.reg = reg
 
-		self.systems = {
-			'M0': {
-				'buswidth': 32,	# ?
-				'interrupts': 32,
-				'cpu': {
-					'name': 'CM0',
-					'revision': 'r0p1',
-					'endian': 'little',
-					'vendorSystickConfig': 0,
-					'mpuPresent': 0,
-					'fpuPresent': 0,
-					'icachePresent': 0,
-					'dcachePresent': 0,
-					'nvicPrioBits': 4,
-					'vtorPresent': 0
-				}
-			},
+		# which one, for registers in arrays
+		self.element = element
 
-			'AP': {
-				'buswidth': 64,
-				'interrupts': 0,
-				'cpu': {
-					'name': 'CA7',
-					'revision': 'r0p1',
-					'endian': 'little',
-					'vendorSystickConfig': 0,
-					'mpuPresent': 1,
-					'fpuPresent': 1,
-					'icachePresent': 1,
-					'dcachePresent': 1,
-					'nvicPrioBits': 4,
-					'vtorPresent': 1
-				}
+	def __repr__ (self):
+		return '%s.%s@0x%x-0x%x' % (self.per.name, self.reg.name, self.start, self.end)
+
+class AddressIndex (object):
+	def __init__ (self, intervals):
+		self.intervals = sorted (intervals, key=lambda i: (i.start, i.end))
+		self.starts = [i.start for i in self.intervals]
+
+		# furthest any interval up to here reaches, so lookups know how
+		# far back to look for ones that overlap
+		self.max_ends = []
+		reach = 0
+		for i in self.intervals:
+			reach = max (reach, i.end)
+			self.max_ends.append (reach)
+
+		# [(earlier, later)]
+		self.overlaps = []
+		for (n, i) in enumerate (self.intervals):
+			for earlier in self.containing (i.start, n):
+				self.overlaps.append ((earlier, i))
+
+	def containing (self, addr, n=None):
+		# intervals (before the nth) that addr is in
+		if n is None:
+			n = bisect.bisect_right (self.starts, addr)
+
+		found = []
+		n -= 1
+		while n >= 0 and self.max_ends[n] > addr:
+			if self.intervals[n].end > addr:
+				found.append (self.intervals[n])
+
+			n -= 1
+
+		return found[::-1]
+
+	def lookup (self, addr):
+		# [(interval, [bits])] for everything at addr; usually just the one
+		found = []
+		for i in self.containing (addr):
+			# the bits of the byte at addr
+			lo = (addr - i.start) * 8
+			bits = [b for b in i.reg.bits if b.bit_range[1] <= lo + 7 and b.bit_range[0] >= lo]
+			found.append ((i, bits))
+
+		return found
+
+# what the register headers expect from elsewhere (linux/types.h and friends)
+HEADER_PREAMBLE = '''
+typedef unsigned char u8;
+typedef unsigned short u16;
+typedef unsigned int u32;
+typedef unsigned long long u64;
+typedef u8 uint8_t;
+typedef u16 uint16_t;
+typedef u32 uint32_t;
+typedef u64 uint64_t;
+'''
+
+# sizes of the C types that can make up a register
+C_TYPE_SIZES = {
+	'char': 1,
+	'short': 2,
+	'short int': 2,
+	'int': 4,
+	'': 4,		# plain unsigned
+	'long long': 8,
+	'long long int': 8
+}
+
+# register sizes, by bytes
+STRUCT_REGISTER_SIZES = { 1: 'B', 2: 'HW', 4: 'W', 8: 'DW' }
+
+def clean_header (fname, text, defines):
+	# what pycparser can take without a real preprocessor: no comments, no
+	# directives and no macro calls at file scope (like U-Boot's
+	# check_member (...)); #defines of a value become enum constants, and
+	# their names are added to defines. keeps the line numbers
+	text = re.sub ('/\\*.*?\\*/', lambda m: '\n' * m.group().count ('\n'), text, flags=re.S)
+	text = re.sub ('//[^\n]*', '', text)
+
+	lines = ['# 1 "%s"' % fname]
+	continued = []
+	for line in text.split ('\n'):
+		if line.endswith ('\\'):
+			continued.append (line[:-1])
+			continue
+
+		# blank lines for the ones joined on, to keep the count
+		line = ' '.join (continued + [line]) + '\n' * len(continued)
+		continued = []
+
+		m = re.match ('\s*#\s*define\s+(\w+)\s+([\w\s()+\-*/<>|&~]+)$', line.rstrip ('\n'))
+		if m:
+			defines.append (m.group(1))
+			line = 'enum { %s = (%s) };' % (m.group(1), m.group(2).strip()) + '\n' * line.count ('\n')
+		elif line.lstrip ().startswith ('#') or re.match ('\w+\s*\(.*\)\s*;\s*$', line.rstrip ('\n')):
+			line = '\n' * line.count ('\n')
+
+		lines.append (line)
+
+	return '\n'.join (lines)
+
+# register layouts of the structs (and #defines) in parsed C headers
+class StructLayout (object):
+	def __init__ (self, ast, defines=()):
+		self.structs = {}
+		self.typedefs = {}
+		self.defines = defines
+
+		# enumerators (and #defines) by name, evaluated when first used
+		self.enumerators = {}
+		self.constants = {}
+
+		self.collect (ast)
+
+	def collect (self, node):
+		if isinstance (node, (pycparser.c_ast.Struct, pycparser.c_ast.Union)) and node.decls is not None and node.name:
+			self.structs[node.name] = node
+		elif isinstance (node, pycparser.c_ast.Typedef):
+			self.typedefs[node.name] = node.type
+		elif isinstance (node, pycparser.c_ast.EnumeratorList):
+			previous = None
+			for e in node.enumerators:
+				self.enumerators[e.name] = (e.value, previous)
+				previous = e.name
+
+		for (_, child) in node.children ():
+			self.collect (child)
+
+	def constant (self, node):
+		if isinstance (node, pycparser.c_ast.Constant):
+			value = node.value.rstrip ('uUlL')
+			if re.match ('0[0-7]+$', value):
+				return int(value, 8)
+
+			return int(value, 0)
+
+		if isinstance (node, pycparser.c_ast.ID):
+			return self.named_constant (node.name)
+
+		if isinstance (node, pycparser.c_ast.UnaryOp):
+			value = self.constant (node.expr)
+			return { '-': -value, '+': value, '~': ~value }[node.op]
+
+		if isinstance (node, pycparser.c_ast.BinaryOp):
+			left = self.constant (node.left)
+			right = self.constant (node.right)
+			return {
+				'+': lambda: left + right,
+				'-': lambda: left - right,
+				'*': lambda: left * right,
+				# C truncates towards zero, rather than flooring
+				'/': lambda: abs (left) // abs (right) * (1 if (left < 0) == (right < 0) else -1),
+				'<<': lambda: left << right,
+				'>>': lambda: left >> right,
+				'|': lambda: left | right,
+				'&': lambda: left & right
+			}[node.op] ()
+
+		raise ValueError ('not a constant: %s' % node.coord)
+
+	def named_constant (self, name):
+		if name not in self.constants:
+			if name not in self.enumerators:
+				raise ValueError ('unknown constant %s' % name)
+
+			(value, previous) = self.enumerators[name]
+			if value is not None:
+				self.constants[name] = self.constant (value)
+			elif previous is not None:
+				self.constants[name] = self.named_constant (previous) + 1
+			else:
+				self.constants[name] = 0
+
+		return self.constants[name]
+
+	def resolve (self, node):
+		# through TypeDecls and typedefs, to a struct, union or basic type
+		while True:
+			if isinstance (node, pycparser.c_ast.TypeDecl):
+				node = node.type
+			elif isinstance (node, pycparser.c_ast.IdentifierType) and ' '.join (node.names) in self.typedefs:
+				node = self.typedefs[' '.join (node.names)]
+			elif isinstance (node, (pycparser.c_ast.Struct, pycparser.c_ast.Union)) and node.decls is None:
+				node = self.structs[node.name]
+			else:
+				return node
+
+	def size (self, node):
+		# (size, alignment) in bytes
+		node = self.resolve (node)
+		if isinstance (node, pycparser.c_ast.ArrayDecl):
+			(size, align) = self.size (node.type)
+			return (size * self.constant (node.dim), align)
+
+		if isinstance (node, pycparser.c_ast.IdentifierType):
+			name = ' '.join (n for n in node.names if n not in ('signed', 'unsigned'))
+			size = C_TYPE_SIZES[name]
+			return (size, size)
+
+		(members, size, align) = self.members (node)
+		return (size, align)
+
+	def members (self, node):
+		# ([(decl, offset)], size, alignment) of a struct or union
+		members = []
+		offset = 0
+		size = 0
+		align = 1
+		for decl in node.decls:
+			(member_size, member_align) = self.size (decl.type)
+			align = max (align, member_align)
+
+			if isinstance (node, pycparser.c_ast.Union):
+				members.append ((decl, 0))
+				size = max (size, member_size)
+			else:
+				offset += -offset % member_align
+				members.append ((decl, offset))
+				offset += member_size
+				size = offset
+
+		size += -size % align
+		return (members, size, align)
+
+	def flatten (self, node, name, offset, registers):
+		node = self.resolve (node)
+		if isinstance (node, pycparser.c_ast.ArrayDecl):
+			# one register per item, as name0, name1...
+			(size, align) = self.size (node.type)
+			for i in range(self.constant (node.dim)):
+				self.flatten (node.type, name + str(i), offset + i * size, registers)
+		elif isinstance (node, pycparser.c_ast.IdentifierType):
+			registers.append ((name, offset, self.size (node)[0]))
+		else:
+			members = self.members (node)[0]
+			if isinstance (node, pycparser.c_ast.Union):
+				# the members are all views of the same bytes; just take
+				# the widest (the first, if there's a tie)
+				members = [max (members, key=lambda m: self.size (m[0].type)[0])]
+
+			for (decl, member_offset) in members:
+				# anonymous structs and unions don't add to the name
+				if decl.name is None:
+					member = name
+				elif decl.name.startswith ('reserved') and isinstance (decl.type, pycparser.c_ast.ArrayDecl):
+					# gaps; not a register for each word
+					continue
+				else:
+					member = decl.name if not name else name + '_' + decl.name
+
+				self.flatten (decl.type, member, offset + member_offset, registers)
+
+	def registers (self, struct=None):
+		# [(name, offset, size)] for every member of struct (the only one
+		# there is, if not given); KeyError if there's no such struct
+		if struct is None:
+			assert len(self.structs) == 1
+			struct = list(self.structs)[0]
+
+		registers = []
+		self.flatten (self.structs[struct], '', 0, registers)
+		return registers
+
+	def defined_registers (self, prefix):
+		# [(name, offset, size)] from #define PREFIX_NAME offset, assuming words
+		registers = []
+		for name in self.defines:
+			if name.startswith (prefix):
+				registers.append ((name[len(prefix):].lower (), self.named_constant (name), 4))
+
+		return registers
+
+class Builder (object):
+	systems = {
+		'M0': {
+			'buswidth': 32,	# ?
+			'interrupts': 32,
+			'cpu': {
+				'name': 'CM0',
+				'revision': 'r0p1',
+				'endian': 'little',
+				'vendorSystickConfig': 0,
+				'mpuPresent': 0,
+				'fpuPresent': 0,
+				'icachePresent': 0,
+				'dcachePresent': 0,
+				'nvicPrioBits': 4,
+				'vtorPresent': 0
+			}
+		},
+
+		'AP': {
+			'buswidth': 64,
+			'interrupts': 0,
+			'cpu': {
+				'name': 'CA7',
+				'revision': 'r0p1',
+				'endian': 'little',
+				'vendorSystickConfig': 0,
+				'mpuPresent': 1,
+				'fpuPresent': 1,
+				'icachePresent': 1,
+				'dcachePresent': 1,
+				'nvicPrioBits': 4,
+				'vtorPresent': 1
 			}
 		}
+	}
 
-		assert name in self.systems
-		self.cpu = self.systems[name]['cpu']
+	def __init__ (self, name, cache=True, keep_going=False, parts=None, lazy=False):
+		self.p = Parser()
+		self.cache = Cache (enabled=cache)
+
+		# export anyway if the parse found errors
+		self.keep_going = keep_going
+
+		# where load_datasheet writes everything the parse tripped over
+		self.diagnostics_report = 'parse-diagnostics.json'
+
+		self.map = {}
+		self.addrmap = {}
+		self.addrmap_noremap = {}
 
 		self.size_to_bits = {
 			'W': 32,
@@ -81,6 +475,27 @@ class Builder (object):
 
 		self.field_names = {}
 
+		# made up by name_fields in batch mode; used, but not saved
+		self.suggested_names = {}
+
+		# groups to export enumeratedValues for ('ALL' for every group)
+		self.enum_groups = set()
+		self.enum_defs = {}
+
+		# fold numbered registers into dim arrays on export
+		self.fold = False
+
+		# leave registers out of the export that overlap an earlier one in
+		# the same peripheral, rather than just warning about them
+		self.drop_overlaps = False
+		self.overlapped = {}
+		self.addr_index = None
+
+		# what to export DW registers as: skip, native (64-bit) or split
+		# (into 32-bit _LO and _HI halves)
+		self.dw = 'skip'
+		self.folded = {}
+
 		self.load_fields()
 
 		self.access_policy_map = {
@@ -101,15 +516,11 @@ class Builder (object):
 			}
 		}
 
-		self.bus = {
-			'addressUnitBits': 8,
-			
-			'width': self.systems[name]['buswidth'],
-
-			'size': 32, # assume 32-bit registers by default
-			'resetValue': 0x0, # default reset
-			'resetMask': '0xFFFFFFFF' # reset value applies all bits
-		}
+		# in document order
+		self.datasheet_parts = parts or [
+			'data/rk3399-part1.xml',
+			'data/rk3399-part2.xml'
+		]
 
 		self.peripherals_from_structs = {
 			'PMUSGRF': {
@@ -118,6 +529,19 @@ class Builder (object):
 			}
 		}
 
+		# U-Boot's register structs (arch/arm/include/asm/arch-rockchip/*_rk3399.h,
+		# copied into header_dir) fill in registers missing from the TRM
+		# tables; either a struct, or #defines of offsets with a prefix
+		self.header_dir = 'data/u-boot'
+		self.peripherals_from_headers = {
+			'GRF': { 'struct': 'rk3399_grf_regs' },
+			'PMUGRF': { 'struct': 'rk3399_pmugrf_regs' },
+			'CIC': { 'struct': 'rk3399_ddr_cic_regs' }
+		}
+
+		# parsed once per set of headers; see parse_headers
+		self.header_asts = {}
+
 		self.peripheral_registers_arrayable = {
 			'RKI2C' : {
 				'RKI2C_RXDATA\d+':	{
@@ -140,6 +564,48 @@ class Builder (object):
 
 		self.peripheral_registers = {}
 
+		# what the merged peripherals are built from, apart from their tables
+		self.merge_sources = [__file__, parse_rk_trm.__file__]
+		self.merged = {}
+
+		# lazy: only parse and merge a peripheral when peripheral() first
+		# asks for it, rather than the whole TRM up front
+		self.lazy = lazy
+		self.loaded = set()
+		self.page_indexes = {}
+
+		self.set_target (name)
+
+		if lazy:
+			self.load_map ()
+			return
+
+		self.load_datasheet ()
+		self.load_map ()
+
+		self.load_structs()
+		self.merge_blocks_into_arrays ()
+		self.cache_merged ()
+
+		# after caching, so the merged registers don't depend on the headers
+		self.fill_from_headers ()
+
+	def set_target (self, name):
+		# everything that differs between the cores, apart from the map
+		assert name in self.systems
+		self.name = name
+		self.cpu = self.systems[name]['cpu']
+
+		self.bus = {
+			'addressUnitBits': 8,
+			
+			'width': self.systems[name]['buswidth'],
+
+			'size': 32, # assume 32-bit registers by default
+			'resetValue': 0x0, # default reset
+			'resetMask': '0xFFFFFFFF' # reset value applies all bits
+		}
+
 		# these are MULTIPLEXED via the Interrupt Arbitrator INT_ARBx
 		# you'll get an Interrupt, then have to decode which of the 8
 		# did it map to (if you've enabled more than one that map
@@ -149,65 +615,56 @@ class Builder (object):
 		# actually only 18 on PERILPM0
 		self.interrupts = self.systems[name]['interrupts']
 
-		self.load_datasheet ()
-		self.load_map ()
-
-		self.load_structs()
-		self.merge_blocks_into_arrays ()
+	def retarget (self, name):
+		# another builder for a different core, sharing our register model;
+		# only the peripheral map (and the cpu bits) need redoing
+		b = copy.copy (self)
+		b.map = {}
+		b.addrmap = {}
+		b.addrmap_noremap = {}
+
+		b.set_target (name)
+		b.load_map ()
+		b.addr_index = None
+
+		return b
+
+	def parse_headers (self, fnames):
+		# (ast, #define names) for all of fnames, in one pycparser pass
+		key = tuple (fnames)
+		if key in self.header_asts:
+			return self.header_asts[key]
+
+		sources = list (fnames) + [__file__]
+		parsed = self.cache.get ('headers', sources)
+		if parsed is None:
+			defines = []
+			text = [HEADER_PREAMBLE]
+			for fname in fnames:
+				with open (fname, 'r') as f:
+					text.append (clean_header (fname, f.read (), defines))
+
+			parsed = (pycparser.CParser ().parse ('\n'.join (text), 'headers'), defines)
+			self.cache.put ('headers', sources, parsed)
+
+		self.header_asts[key] = parsed
+		return parsed
 
 	def parse_struct(self, fname):
-		structs = {}
-		ast = pycparser.parse_file(fname)
-		for toplevel_child in ast.ext:
-			if isinstance(toplevel_child.type, pycparser.c_ast.Struct):
-				struct_offsets = {}
-				byte_offset = 0
-
-				# have the struct
-				struct = toplevel_child.type
-				for child in struct.decls:
-					name = child.name
-
-					child_size = 0
-					if isinstance(child.type, pycparser.c_ast.TypeDecl):
-						# single instance, just add by name
-						typenode = child.type.type
-						assert typenode.names[0] == 'u32'
-						child_size = 4
-
-						struct_offsets[name] = byte_offset
-					elif isinstance(child.type, pycparser.c_ast.ArrayDecl):
-						# also need to emit one register for each array entry
-						# UNLESS it's "reserved"
-
-						arraynode = child.type
-						typenode = arraynode.type.type
-						assert typenode.names[0] == 'u32'
-
-						value = arraynode.dim.value
-						if value.lower().startswith('0x'):
-							value = int(value[2:], 16)
-						else:
-							value = int(value)
-
-						child_size = 4 * value
-
-						array_item_offset = 0
-						if not name.startswith('reserved'):
-							# generate individual register per array item
-							for i in range(value):
-								struct_offsets[name + str(i)] = byte_offset + (array_item_offset)
-								array_item_offset += 4
-						
-					else:
-						assert False
-					
-					byte_offset += child_size
+		# [(name, offset, size)] of the one struct in fname
+		return StructLayout (*self.parse_headers ([fname])).registers ()
 
-				structs[toplevel_child.name] = struct_offsets
+	def struct_register (self, name, offset, size):
+		if size not in STRUCT_REGISTER_SIZES:
+			print('WARNING: skipping', name, 'as registers can\'t be', size, 'bytes')
+			return None
 
-		assert len(structs) == 1
-		return list(structs.values())[0]
+		newr = Register (name)
+		newr.bits = []
+		newr.address_offsets = [offset]
+		newr.description = name # FIXME: nicer names :)
+		newr.size = STRUCT_REGISTER_SIZES[size]
+		return newr
 
 	def parse_register_textfile(self, registers, reginfo):
 		def assign_split_withdefault(x):
@@ -360,63 +817,127 @@ class Builder (object):
 
 	def load_structs(self):
 		for (per_for_struct, info) in self.peripherals_from_structs.items():
-			# hash from reg -> offset
-			struct = self.parse_struct(info['struct'])
-
-			# convert struct to registers
-			registers = {}
-			for field, offset in struct.items():
-				newr = Register (field)
-				newr.bits = []
-				newr.address_offsets = [offset]
-				newr.description = field # FIXME: nicer names :)
-				newr.size = 'W'
-				#newr.reset_value = reg_params['reset']
-				# TODO: give a reset value later, but only
-				# if we know all the reset values for each bit
-
-				registers[field] = newr
-
-			with open(info['registers'], 'r') as f:
-				self.parse_register_textfile(registers, f)
-
-
-			# conver to list
-			registers = list(registers.values())
-			for reg in registers:
-				reset_value = 0
-				unset = list(range(32))
-				for bit in reg.bits:
-					s = list(sorted(bit.bit_range))
-					# print bit.name, s
+			self.load_struct (per_for_struct, info)
+
+	def load_struct (self, per_for_struct, info):
+		# parse_struct and friends live in this file, so it's a source too
+		sources = [info['struct'], info['registers'], __file__]
+		registers = self.cache.get ('struct-' + per_for_struct, sources)
+		if registers is not None:
+			self.peripheral_registers[per_for_struct] = RegisterList (registers)
+			return
 
-					for i in range(s[0], s[1] + 1):
-						unset[i] = None
+		# convert struct to registers
+		registers = {}
+		for (field, offset, size) in self.parse_struct(info['struct']):
+			newr = self.struct_register (field, offset, size)
+			if newr is None:
+				continue
 
-					if not bit.reset_value:
-						print('WARNING: ', bit.name, 'has no reset value; assuming 0')
-						bit.reset_value = 0
+			#newr.reset_value = reg_params['reset']
+			# TODO: give a reset value later, but only
+			# if we know all the reset values for each bit
 
-					reset_value |= bit.reset_value << s[0]
+			registers[field] = newr
 
-				print(reg, unset)
-				have_unknown = any(unset)
-				if have_unknown:
-					print("WARNING: don't fully know register", reg)
-					print('Pretending reset value is 0')
-					reg.reset_value = 0
-				else:
-					print('calculated reset value for', reg)
-					reg.reset_value = reset_value
+		with open(info['registers'], 'r') as f:
+			self.parse_register_textfile(registers, f)
 
 
-			# add registers and bit accesses to peripheral!
-			self.peripheral_registers[per_for_struct] = registers
-			# print self.peripheral_registers
+		# conver to list
+		registers = list(registers.values())
+		known = 0
+		for reg in registers:
+			for bit in reg.bits:
+				if bit.reset_value is None:
+					print('WARNING: ', bit.name, 'has no reset value; assuming 0')
+					bit.reset_value = 0
+
+			coverage = Coverage (reg.bits, self.size_to_bits[reg.size])
+			if coverage.gaps ():
+				print("WARNING: don't fully know register", reg, '(bits %s)' % mask_ranges (coverage.gaps ()))
+				print('Pretending reset value is 0')
+				reg.reset_value = 0
+			else:
+				reg.reset_value = coverage.reset
+				known += 1
+
+		print('calculated reset values for %d of %d %s registers' % (known, len(registers), per_for_struct))
+
+		# add registers and bit accesses to peripheral!
+		self.peripheral_registers[per_for_struct] = RegisterList (registers)
+		self.cache.put ('struct-' + per_for_struct, sources, registers)
+		# print self.peripheral_registers
+
+	def header_layout (self):
+		if not os.path.isdir (self.header_dir):
+			return None
+
+		headers = sorted (glob.glob (os.path.join (self.header_dir, '*_rk3399.h')))
+		return StructLayout (*self.parse_headers (headers))
+
+	def fill_from_headers (self):
+		layout = self.header_layout ()
+		if layout is None:
+			return
+
+		for (per, info) in self.peripherals_from_headers.items ():
+			self.fill_from_header (per, info, layout)
+
+	def fill_from_header (self, per, info, layout):
+		try:
+			if 'struct' in info:
+				found = layout.registers (info['struct'])
+			else:
+				found = layout.defined_registers (info['defines'])
+		except KeyError:
+			print('WARNING: nothing for', per, 'in', self.header_dir, info)
+			return
+
+		# only where the TRM has nothing; by the byte, so nothing
+		# overlaps a register that's already there
+		registers = self.peripheral_registers.setdefault (per, RegisterList ())
+		covered = set()
+		for reg in registers:
+			width = self.size_to_bits[reg.size] // 8
+			for offset in reg.address_offsets:
+				for element in range(reg.dim or 1):
+					start = offset + element * (reg.dimIncrement if reg.dim else 0)
+					covered.update (range(start, start + width))
+
+		added = 0
+		for (name, offset, size) in found:
+			if covered.intersection (range(offset, offset + size)):
+				continue
+
+			reg = self.struct_register ('%s_%s' % (per, name.upper()), offset, size)
+			if reg is None:
+				continue
+
+			# no bits, so no idea
+			reg.reset_value = 0
+
+			registers.append (reg)
+			covered.update (range(offset, offset + size))
+			added += 1
+
+		print('filled in %d %s registers from %s' % (added, per, self.header_dir))
+
+	def coverage_report (self, fname):
+		# {peripheral: {register: [width, defined, overlap, reset, known]}}
+		# for every register; see Coverage
+		report = {}
+		for (groupname, registers) in self.peripheral_registers.items ():
+			report[groupname] = dict ((reg.name, Coverage (reg.bits, self.size_to_bits[reg.size]).to_json ()) for reg in registers)
+
+		with open (fname, 'w') as f:
+			json.dump (report, f, indent=1, sort_keys=True)
+
+		print('wrote bit coverage of every register to', fname)
 
 	def dump_fields (self):
-		with open ('data/fields.json', 'wb') as f:
-			json.dump (self.field_names, f, indent=4)
+		with open ('data/fields.json', 'w') as f:
+			json.dump (self.field_names, f, indent=4, separators=(', ', ': '))
 
 	def load_fields (self):
 		if not os.path.exists ('data/fields.json'):
@@ -466,20 +987,122 @@ class Builder (object):
 		return (namefrom, namefrom, namebase)
 
 	def load_datasheet (self):
-		for i in [1, 2]:
-			f = open ('data/rk3399-part%d.xml' % i, 'rb')
-			self.p.parse (f)
-			f.close()
+		# the parts don't share any parser state, so parse them side by side
+		# and merge back in document order (which map() keeps for us)
+		#
+		# FIXME: tables run across page boundaries, so we can't split
+		# further than this without knowing where the sections start
+		#
+		# parts we've already parsed (with this version of the parser)
+		# come straight out of the cache instead
+		sources = lambda part: [part, parse_rk_trm.__file__]
+		parsers = [self.cache.get ('trm', sources (x)) for x in self.datasheet_parts]
+		todo = [x for (x, p) in zip (self.datasheet_parts, parsers) if p is None]
+
+		if todo:
+			with concurrent.futures.ProcessPoolExecutor (len(todo)) as pool:
+				parsed = dict (zip (todo, pool.map (parse_file, todo)))
+
+			for part in todo:
+				self.cache.put ('trm', sources (part), parsed[part])
+
+			parsers = [p or parsed[x] for (x, p) in zip (self.datasheet_parts, parsers)]
+		else:
+			print('using cached parse of', ', '.join (self.datasheet_parts))
+
+		for p in parsers:
+			self.p.extend (p)
 
 		self.p.check()
 
-		# merge groups and registers
-		
-		# copy from summaries first
+		# merge groups and registers, a peripheral at a time. each one only
+		# depends on its own tables, so the ones that haven't changed since
+		# last time (ie. all but those in a part you've just replaced) come
+		# out of the cache, already merged and folded into arrays
+		summaries = {}
+		registers = {}
 		for regsum in self.p.register_summaries:
-			pname = regsum.name.split('_')[0]
+			summaries.setdefault (regsum.name.split('_')[0], []).append (regsum)
+		for r in self.p.registers:
+			registers.setdefault (r.name.split('_')[0], []).append (r)
+
+		pnames = list(summaries) + [x for x in registers if x not in summaries]
+		for pname in pnames:
+			self.merge_tables (pname, summaries.get (pname, []), registers.get (pname, []))
+
+		print('merged %d of %d peripherals (the rest were cached)' % (len(self.merged), len(pnames)))
+
+		# one report for everything we tripped over, rather than stopping
+		# at the first
+		self.p.diagnostics.report (self.diagnostics_report)
+		print('parse diagnostics:', self.p.diagnostics.summary (), '(see %s)' % self.diagnostics_report)
+		if self.p.diagnostics.errors () and not self.keep_going:
+			print('stopping; fix the above (or pass --keep-going)')
+			sys.exit (1)
+
+	def merge_tables (self, pname, summaries, registers):
+		# merge one peripheral's tables, unless it's cached; the ones we do
+		# merge go in self.merged as pname -> (fingerprint of its tables,
+		# diagnostics), and cache_merged() stores them once they're finished
+		tables = (summaries, registers)
+		fingerprint = self.cache.object_digest (tables)
+
+		cached = None
+		if pname not in self.peripherals_from_structs:
+			cached = self.cache.get ('merged-' + pname, self.merge_sources, fingerprint)
+
+		if cached is not None:
+			self.peripheral_registers[pname], diagnostics = cached
+			self.p.diagnostics.items += diagnostics
+			return
+
+		first = len(self.p.diagnostics.items)
+		self.merge_peripheral (pname, *tables)
+		self.merged[pname] = (fingerprint, self.p.diagnostics.items[first:])
+
+	def peripheral (self, pname):
+		# pname's registers, merged and with its arrays folded; a lazy
+		# builder does all that on first use, from just pname's tables
+		if self.lazy and pname not in self.loaded:
+			self.load_peripheral (pname)
+
+		return self.peripheral_registers[pname]
+
+	def load_peripheral (self, pname):
+		self.loaded.add (pname)
+
+		if pname in self.peripherals_from_structs:
+			self.load_struct (pname, self.peripherals_from_structs[pname])
+		else:
+			p = Parser ()
+			for part in self.datasheet_parts:
+				if part not in self.page_indexes:
+					self.page_indexes[part] = PageIndex.load (part)
+
+				p.parse_peripheral (part, pname, self.page_indexes[part])
+
+			p.check ()
+			print('parse diagnostics for %s:' % pname, p.diagnostics.summary ())
+
+			self.p.extend (p)
+			self.merge_tables (pname, p.register_summaries, p.registers)
+
+		if pname in self.peripheral_registers_arrayable and pname in self.peripheral_registers:
+			if pname in self.merged or pname in self.peripherals_from_structs:
+				self.merge_arrays (pname)
+
+		self.cache_merged ([pname])
+
+		if pname in self.peripherals_from_headers:
+			layout = self.header_layout ()
+			if layout is not None:
+				self.fill_from_header (pname, self.peripherals_from_headers[pname], layout)
+
+	def merge_peripheral (self, pname, summaries, registers):
+		# copy from summaries first
+		for regsum in summaries:
 			if pname not in self.peripheral_registers:
-				self.peripheral_registers[pname] = []
+				self.peripheral_registers[pname] = RegisterList ()
 
 			if '~' in regsum.name:
 				# make multiple registers
@@ -501,7 +1124,7 @@ class Builder (object):
 				self.peripheral_registers[pname].append (r)
 			
 		# now do per-register, and get bit access
-		for r in self.p.registers:	
+		for r in registers:
 			if not r.bits:
 				print(r.name, 'has no bits; skipping')
 				continue
@@ -517,12 +1140,12 @@ class Builder (object):
 				existing = self.find_and_update_from_register (r)
 
 				# and expand it out now if we need
-				if len(existing.address_offsets) > 1:
+				if existing is not None and len(existing.address_offsets) > 1:
 					# also make multiple registers, and delete the old
 					# clone it n times first
 					regname_idx = 0
 					for offset in existing.address_offsets:
-						newr = Register ('%s%d' % (regsum.name, regname_idx))
+						newr = Register ('%s%d' % (r.name, regname_idx))
 						newr.bits = existing.bits
 						newr.address_offsets = [offset]
 						newr.description = existing.description
@@ -533,7 +1156,7 @@ class Builder (object):
 						self.peripheral_registers[pname].append (newr)
 
 					# and remove the old
-					self.peripheral_registers[r.name.split('_')[0]].remove(existing)
+					self.peripheral_registers[pname].remove(existing)
 
 	def merge_blocks_into_arrays (self):
 		for groupname in self.peripheral_registers_arrayable:
@@ -541,36 +1164,54 @@ class Builder (object):
 				print('WARNING: have array access defined on peripheral', groupname, 'but not in datasheet?')
 				continue
 
-			transformations = self.peripheral_registers_arrayable[groupname]
-			for transform in transformations:
-				replacement_info = transformations[transform]
+			if groupname not in self.merged and groupname not in self.peripherals_from_structs:
+				# cached, so already done
+				continue
+
+			self.merge_arrays (groupname)
 
-				# find out the keys of the registers we're removing for this transformation
-				to_remove = [x for x in self.peripheral_registers[groupname] if (x if re.match(transform, x.name) else None)]
-				# print to_remove
+	def merge_arrays (self, groupname):
+		transformations = self.peripheral_registers_arrayable[groupname]
+		for transform in transformations:
+			replacement_info = transformations[transform]
 
-				# ensure all the right size
-				for reg in to_remove:
-					assert self.size_to_bits[reg.size] == 32
+			# find out the keys of the registers we're removing for this transformation
+			to_remove = [x for x in self.peripheral_registers[groupname] if (x if re.match(transform, x.name) else None)]
+			# print to_remove
 
-				dim = len(to_remove)
-				print('Converted %d registers to array using %s' % (dim, transform))
+			# ensure all the right size
+			for reg in to_remove:
+				assert self.size_to_bits[reg.size] == 32
 
-				# keep the first one to use as the "array register", and remove the others
-				base = to_remove[0]
-				for r in to_remove[1:]:
-					self.peripheral_registers[groupname].remove(r)
+			dim = len(to_remove)
+			print('Converted %d registers to array using %s' % (dim, transform))
 
-				# update in-place to use the generic array data
-				base.name = replacement_info['name']
-				base.description = replacement_info['description']
-				base.bits = replacement_info['bits']
+			# keep the first one to use as the "array register", and remove the others
+			base = to_remove[0]
+			for r in to_remove[1:]:
+				self.peripheral_registers[groupname].remove(r)
 
-				base.dim = dim
+			# update in-place to use the generic array data
+			self.peripheral_registers[groupname].rename (base, replacement_info['name'])
+			base.description = replacement_info['description']
+			base.bits = replacement_info['bits']
 
-				# probably optional, but hey
-				base.dimIndex = '0-%s' % (dim - 1)
-				base.dimIncrement = 32 // 8
+			base.dim = dim
+
+			# probably optional, but hey
+			base.dimIndex = '0-%s' % (dim - 1)
+			base.dimIncrement = 32 // 8
+
+	def cache_merged (self, pnames=None):
+		# the peripherals we had to merge this time, for next time
+		for pname, (fingerprint, diagnostics) in self.merged.items ():
+			if pnames is not None and pname not in pnames:
+				continue
+
+			if pname not in self.peripheral_registers or pname in self.peripherals_from_structs:
+				continue
+
+			self.cache.put ('merged-' + pname, self.merge_sources, (self.peripheral_registers[pname], diagnostics), fingerprint)
 
 
 	def find_and_update_from_register (self, r, searchname=None):
@@ -578,17 +1219,14 @@ class Builder (object):
 			searchname = r.name
 
 		pname = searchname.split('_')[0]
-		assert pname in self.peripheral_registers
 
 		existing_reg = None
-		for reg in self.peripheral_registers[pname]:
-			if reg.name == searchname:
-				existing_reg = reg
-				break
+		if pname in self.peripheral_registers:
+			existing_reg = self.peripheral_registers[pname].get (searchname)
 
 		if existing_reg is None:
-			print('no general map for', searchname)
-			assert existing_reg
+			self.p.diagnostics.error ('no general map for %s' % searchname, state='merge', page=r.page)
+			return None
 
 		self.copy_from_existing_reg (r, existing_reg)
 		return existing_reg
@@ -624,21 +1262,15 @@ class Builder (object):
 		# FIXME: may need to handle ~ ranges here?
 		new_reg.bits = old_reg.bits
 
-	def parse_hex (self, h):
-		if '_' in h:
-			return int(h.replace('_', ''), 16)
-		elif h.startswith ('0x'):
-			return int(h[2:], 16)
-		else:
-			#return int(h)
-			# raise ValueError (h + " should be in hex")
-			return eval (h, self.addrmap_noremap)
-
-	def load_map (self):
-		system_peripheral_base_key = 'CORE_PERIPHERAL_BASE'
-		mcu_peripheral_base_prefix = 'MCU_PERIPHERAL_BASE'
-		mcu_peripheral_base_key = '%s_%s' % (mcu_peripheral_base_prefix, self.name)
+	def parse_hex (self, h, lookup=None):
+		# lookup defaults to the (unremapped) addresses mapped so far
+		return eval_address (parse_address (h), lookup or self.addrmap_noremap.get)
 
+	def read_map (self):
+		# [(block, PeripheralMap, value)] in file order, with the addresses
+		# left to fill in; block is None outside of blocks, and there's no
+		# PeripheralMap (or value) for the block itself
+		entries = []
 		with open ('data/peripheral-map.txt', 'r') as f:
 			current_peripheral = None
 			for line in f:
@@ -658,25 +1290,7 @@ class Builder (object):
 					assert current_peripheral
 
 					key, value = list(map(str.strip, cmd.split('\t')))
-					original_addr = self.parse_hex (value)
-					addr = original_addr
-
-					# remap to MCU
-					if key != system_peripheral_base_key and not key.startswith(mcu_peripheral_base_prefix):
-						addr -= self.addrmap[system_peripheral_base_key]
-						if addr < 0:
-							print('ERROR:', key, 'is below peripheral base?', addr, self.addrmap[system_peripheral_base_key])
-							sys.exit (1)
-
-						addr += self.addrmap[mcu_peripheral_base_key]
-
-					p = PeripheralMap (key, addr, current_peripheral)
-					self.map[current_peripheral].append (p)
-
-					self.addrmap[p.name] = addr
-					self.addrmap_noremap[p.name] = original_addr
-
-					print('\tsubperipheral', p)
+					entries.append ((current_peripheral, PeripheralMap (key, None, current_peripheral), value))
 				else:
 					cmd = cmd.strip()
 
@@ -684,262 +1298,927 @@ class Builder (object):
 						current_peripheral = None
 
 						# key value
-						print(cmd)
 						key, value = list(map(str.strip, cmd.split('\t')))
-						if key in self.map:
-							raise ValueError(key + " maps multiple times; use block instead")
+						entries.append ((None, PeripheralMap (key, None), value))
+					elif cmd:
+						# mapping single peripheral to multiple devices
+						current_peripheral = cmd
+						entries.append ((cmd, None, None))
 
-						addr = self.parse_hex (value)
-						original_addr = addr
+		return entries
 
-						# remap to MCU
-						if key != system_peripheral_base_key and not key.startswith(mcu_peripheral_base_prefix):
-							addr -= self.addrmap[system_peripheral_base_key]
-							if addr < 0:
-								print('ERROR:', key, 'is below peripheral base?')
-								sys.exit (1)
+	def resolve_map (self, entries):
+		# every entry's address as written (before remapping), whatever
+		# order they're in, so they can refer to ones further down
+		values = dict ((p.name, value) for (block, p, value) in entries if p is not None)
+		resolved = {}
+		resolving = []
 
-							addr += self.addrmap[mcu_peripheral_base_key]
+		def lookup (name):
+			if name not in values:
+				return None
 
+			if name not in resolved:
+				if name in resolving:
+					raise ValueError ('%s is defined in terms of itself (%s)' % (name, ' -> '.join (resolving + [name])))
 
-						self.map[key] = [PeripheralMap (key, addr)]
-						self.addrmap[key] = addr
-						self.addrmap_noremap[key] = original_addr
-					elif cmd:
-						# mapping single peripheral to multiple devices
-						print("-- entering block '%s'" % cmd)
-						current_peripheral = cmd
-						self.map[current_peripheral] = []
+				resolving.append (name)
+				resolved[name] = self.parse_hex (values[name], lookup)
+				resolving.pop ()
+
+			return resolved[name]
+
+		for key in values:
+			lookup (key)
+
+		return resolved
+
+	def load_map (self):
+		system_peripheral_base_key = 'CORE_PERIPHERAL_BASE'
+		mcu_peripheral_base_prefix = 'MCU_PERIPHERAL_BASE'
+		mcu_peripheral_base_key = '%s_%s' % (mcu_peripheral_base_prefix, self.name)
+
+		entries = self.read_map ()
+		addresses = self.resolve_map (entries)
+
+		for (block, p, value) in entries:
+			if p is None:
+				print("-- entering block '%s'" % block)
+				self.map[block] = []
+				continue
+
+			original_addr = addresses[p.name]
+			addr = original_addr
+
+			# remap to MCU
+			if p.name != system_peripheral_base_key and not p.name.startswith(mcu_peripheral_base_prefix):
+				addr -= addresses[system_peripheral_base_key]
+				if addr < 0:
+					print('ERROR:', p.name, 'is below peripheral base?', addr, addresses[system_peripheral_base_key])
+					sys.exit (1)
+
+				addr += addresses[mcu_peripheral_base_key]
+
+			p.base_addr = addr
+
+			if block is None:
+				print('%s\t%s' % (p.name, value))
+				if p.name in self.map:
+					raise ValueError(p.name + " maps multiple times; use block instead")
+
+				self.map[p.name] = [p]
+			else:
+				self.map[block].append (p)
 
+				print('\tsubperipheral', p)
+
+			self.addrmap[p.name] = addr
+			self.addrmap_noremap[p.name] = original_addr
 
 		print(self.map)
 
-	def export (self):
-		ET.register_namespace ('xs', 'http://www.w3.org/2001/XMLSchema-instance')
+	def field_name (self, reg, bit):
+		if 'name' not in bit.__dict__:
+			if '\n' in bit.description:
+				name, desc = bit.description.split('\n', 1)
+			else:
+				# FIXME: svd-parser assumption may also apply to this field?
+				name, desc = (bit.description, '')
+
+			if ' ' in name:
+				# no name; copy name from register
+				# but ONLY if it's the only one
+				if len(reg.bits) == 1:
+					desc = name
+					name = reg.name
+
+					# to handle arrays
+					if '%s' in name:
+						name = name.replace('%s', '')
+				else:
+					if bit.description in self.field_names:
+						name = self.field_names[bit.description]
+					elif bit.description in self.suggested_names:
+						# batch mode; see name_fields
+						name = self.suggested_names[bit.description]
+					else:
+						name = self.ask_field_name (reg, bit)
+						self.dump_fields()
+
+					desc = bit.description
+		else:
+			name = bit.name
+			desc = None
+
+		if not desc:
+			desc = bit.description
+
+		return (name, desc)
+
+	def ask_field_name (self, reg, bit):
+		print('there are %d other bits' % len(reg.bits))
+		print("unknown name for this register:")
+		print(bit.description)
+		name = input("name for register? ")
+		self.field_names[bit.description] = name
+
+		return name
+
+	def needs_field_name (self, reg, bit):
+		# whether field_name has to look the name up in fields.json; ie.
+		# the description doesn't start with one, and there's more than
+		# one field so we can't just use the register's
+		if 'name' in bit.__dict__:
+			return False
+
+		name = bit.description.split('\n', 1)[0]
+		return ' ' in name and len(reg.bits) != 1
+
+	def unnamed_fields (self):
+		# [(reg, bit)] for every field export will need a name for that we
+		# don't have, once per description
+		unnamed = {}
+		for groupname in self.map:
+			for reg in self.peripheral_registers.get (groupname, []):
+				# export skips these
+				if (reg.size == 'DW' and self.dw == 'skip') or reg.name.lower() == 'reserved':
+					continue
+
+				for bit in reg.bits:
+					if bit.description in self.field_names or not self.needs_field_name (reg, bit):
+						continue
+
+					unnamed.setdefault (bit.description, (reg, bit))
 
-		root = ET.Element ('device', {
-			'schemaVersion': '1.3',
-			'{http://www.w3.org/2001/XMLSchema-instance}noNamespaceSchemaLocation': 'CMSIS-SVD_Schema_1_3.xsd'
-		})
+		return list(unnamed.values())
 
-		ET.SubElement (root, 'name').text = 'RK3399-%s' % self.name
-		ET.SubElement (root, 'version').text = '1'
-		ET.SubElement (root, 'description').text = 'Rockchip RK3399 for %s CPU' % self.name
-		for f in self.bus:
-			ET.SubElement (root, f).text = str(self.bus[f])
+	def suggest_field_name (self, reg, bit, taken):
+		# something in the style of the names in fields.json, from the
+		# first line of the description
+		line = re.sub ('^\[[0-9:]+\]\s*', '', bit.description.split('\n', 1)[0])
 
-		cpu = ET.SubElement (root, 'cpu')
+		# it might have the signal name in it (eg. num_i-cache_lines)
+		m = re.search ('[A-Za-z][A-Za-z0-9]*(_[A-Za-z0-9-]+)+', line)
+		if m:
+			words = re.split ('[_-]', m.group (0))
+		else:
+			words = [x for x in re.findall ('[A-Za-z0-9]+', line) if x.lower() not in FIELD_NAME_FILLER][:5]
+
+		name = '_'.join (words).upper()
+		if not name or name[0].isdigit():
+			name = '%s_BITS_%d_%d' % (reg.name, bit.bit_range[0], bit.bit_range[1])
+
+		# names have to be unique (see load_fields)
+		unique = name
+		i = 2
+		while unique in taken:
+			unique = '%s_%d' % (name, i)
+			i += 1
+
+		taken.add (unique)
+		return unique
+
+	def name_fields (self, batch=False, review='data/fields-review.json'):
+		# make sure we know the name of every field export will need, up
+		# front, so export never has to stop and ask
+		#
+		# in batch mode, don't ask at all; make up a name for each of them
+		# and use that, and write them all to review. set "accept" on the
+		# ones you're happy with (fixing the name first if need be), and
+		# the next batch run adds them to fields.json
+		if batch:
+			self.merge_field_review (review)
+
+		unnamed = self.unnamed_fields ()
+
+		if not batch:
+			named = 0
+			try:
+				for (reg, bit) in unnamed:
+					self.ask_field_name (reg, bit)
+					named += 1
+			finally:
+				# just the once, rather than after every answer
+				if named:
+					self.dump_fields ()
+
+			return
+
+		taken = set(self.field_names.values())
+		entries = []
+		for (reg, bit) in unnamed:
+			if bit.description in self.suggested_names:
+				# kept from the last review
+				name = self.suggested_names[bit.description]
+				taken.add (name)
+			else:
+				name = self.suggest_field_name (reg, bit, taken)
+				self.suggested_names[bit.description] = name
+
+			entries.append ({
+				'register': reg.name,
+				'bits': '[%d:%d]' % bit.bit_range,
+				'description': bit.description,
+				'name': name,
+				'accept': False
+			})
+
+		if entries:
+			with open (review, 'w') as f:
+				json.dump (entries, f, indent=4)
+
+			print('made up names for %d fields; check them in %s' % (len(entries), review))
+		elif os.path.exists (review):
+			os.remove (review)
+
+	def merge_field_review (self, review):
+		if not os.path.exists (review):
+			return
+
+		with open (review, 'r') as f:
+			entries = json.load (f)
+
+		taken = set(self.field_names.values())
+		accepted = 0
+		for entry in entries:
+			name = entry['name']
+			if not entry.get ('accept'):
+				# use (and keep suggesting) whatever it was changed to
+				if name and name not in taken:
+					self.suggested_names[entry['description']] = name
+					taken.add (name)
+				continue
+
+			if not name or name in taken:
+				print('WARNING: not accepting', repr(name), 'for', entry['register'], entry['bits'], '(empty or already used)')
+				continue
+
+			self.field_names[entry['description']] = name
+			taken.add (name)
+			accepted += 1
+
+		if accepted:
+			self.dump_fields ()
+			print('added %d field names from %s' % (accepted, review))
+
+	def export (self, out, jobs=1):
+		# write the SVD to out a group of peripherals at a time, rather
+		# than building the whole device in memory first; with jobs > 1,
+		# the groups are rendered side by side in forked workers
+		#
+		# comes out the same as ET.tostring (root, pretty_print=True) would
+		xs = 'http://www.w3.org/2001/XMLSchema-instance'
+
+		header = []
+		for (tag, text) in [
+			('name', 'RK3399-%s' % self.name),
+			('version', '1'),
+			('description', 'Rockchip RK3399 for %s CPU' % self.name)
+		] + [(f, str(self.bus[f])) for f in self.bus]:
+			elem = ET.Element (tag)
+			elem.text = text
+			header.append (elem)
+
+		cpu = ET.Element ('cpu')
 		for f in self.cpu:
 			ET.SubElement (cpu, f).text = str(self.cpu[f])
 
 		ET.SubElement (cpu, 'deviceNumInterrupts').text = str(self.interrupts)
+		header.append (cpu)
+
+		self.check_overlaps ()
 
-		# generate peripherals both ways; from devices -> reg
-		# then only note about the missing ones in the other direction
+		if self.fold:
+			self.fold_arrays ()
 
-		# do device -> reg first
-		peripherals_xml = ET.SubElement (root, 'peripherals')
+		if self.enum_groups:
+			self.collect_enums ()
+
+		with ET.xmlfile (out) as xf:
+			with xf.element ('device', {
+				'schemaVersion': '1.3',
+				'{%s}noNamespaceSchemaLocation' % xs: 'CMSIS-SVD_Schema_1_3.xsd'
+			}, nsmap={'xs': xs}):
+				for elem in header:
+					self.write_element (xf, elem, 1)
+
+				xf.write ('\n  ')
+				with xf.element ('peripherals'):
+					# generate peripherals both ways; from devices -> reg
+					# then only note about the missing ones in the other direction
+
+					# do device -> reg first
+					self.group_timings = []
+					for (groupname, fragment, elapsed) in self.render_groups (jobs):
+						# already serialized, so it goes straight to the file
+						# (xf.write would escape it)
+						xf.flush ()
+						out.write (fragment)
+						self.group_timings.append ((elapsed, groupname))
+
+					xf.write ('\n  ')
+				xf.write ('\n')
+
+		out.write (b'\n')
+
+		print('slowest groups to export:')
+		for (elapsed, groupname) in sorted (self.group_timings, reverse=True)[:10]:
+			print('\t%-16s %.3fs' % (groupname, elapsed))
+
+	def address_index (self):
+		if self.addr_index is not None:
+			return self.addr_index
+
+		intervals = []
 		for groupname in self.map:
-			if groupname not in self.peripheral_registers:
+			registers = self.peripheral_registers.get (groupname)
+			if not registers:
+				continue
+
+			for per in self.map[groupname]:
+				for reg in registers:
+					if reg.name.lower() == 'reserved':
+						continue
+
+					width = self.size_to_bits[reg.size] // 8
+					for offset in reg.address_offsets:
+						for element in range(reg.dim or 1):
+							start = per.base_addr + offset + element * (reg.dimIncrement if reg.dim else 0)
+							intervals.append (AddressInterval (start, start + width, per, reg, element))
+
+		self.addr_index = AddressIndex (intervals)
+		return self.addr_index
+
+	def check_overlaps (self):
+		# the TRM has a few register ranges (and peripherals) that run into
+		# each other, like USB3's DEPnCMDPAR; say which, and note the later
+		# register of each pair inside a peripheral
+		self.overlapped = {}
+		overlaps = self.address_index ().overlaps
+		for (earlier, later) in overlaps:
+			print('WARNING: %r overlaps %r' % (later, earlier))
+
+			if earlier.per is later.per and earlier.reg is not later.reg:
+				self.overlapped.setdefault (later.per.block, set()).add (id(later.reg))
+
+		if overlaps:
+			print('%d overlapping registers%s' % (len(overlaps), '; leaving out the later ones' if self.drop_overlaps else ' (see --drop-overlaps)'))
+
+	def kept_registers (self, groupname):
+		registers = self.peripheral_registers[groupname]
+		if not self.drop_overlaps or groupname not in self.overlapped:
+			return registers
+
+		dropped = self.overlapped[groupname]
+		return [reg for reg in registers if id(reg) not in dropped]
+
+	def decode (self, addr):
+		# what's at addr, for reading bus traces and crash dumps
+		found = self.address_index ().lookup (addr)
+		if not found:
+			return ['0x%08x: nothing mapped' % addr]
+
+		lines = []
+		for (i, bits) in found:
+			reg = i.reg.name.replace ('%s', str(i.element)) if i.reg.dim else i.reg.name
+			fields = []
+			for bit in bits:
+				if 'name' in bit.__dict__:
+					name = bit.name
+				else:
+					name = self.field_names.get (bit.description, bit.description.split ('\n')[0])
+
+				fields.append ('%s[%d:%d]' % ((name,) + tuple(bit.bit_range)))
+
+			lines.append ('0x%08x: %s %s +0x%x %s' % (addr, i.per.name, reg, addr - i.start, ' '.join (fields)))
+
+		return lines
+
+	def export_registers (self, groupname):
+		registers = self.folded.get (groupname) or self.kept_registers (groupname)
+		if self.dw != 'split':
+			return registers
+
+		split = []
+		for reg in registers:
+			if reg.size == 'DW':
+				split.extend (self.split_register (reg))
+			else:
+				split.append (reg)
+
+		return split
+
+	def split_register (self, reg):
+		# a DW register as _LO and _HI words; fields across the middle are
+		# split in two as well, with _LO and _HI on the end of their names
+		halves = []
+		for (suffix, lo) in (('_LO', 0), ('_HI', 32)):
+			half = copy.copy (reg)
+			half.name = reg.name + suffix
+			half.address_offsets = [reg.address_offsets[0] + lo // 8]
+			half.size = 'W'
+			half.reset_value = (reg.reset_value >> lo) & 0xffffffff
+			half.bits = []
+			halves.append (half)
+
+		for bit in reg.bits:
+			(high, low) = bit.bit_range
+			name, desc = self.field_name (reg, bit)
+			for half, lo in zip (halves, (0, 32)):
+				if high < lo or low > lo + 31:
+					continue
+
+				part = copy.copy (bit)
+				part.bit_range = (min (high, lo + 31) - lo, max (low, lo) - lo)
+				part.name = name
+				part.description = desc
+
+				if high > 31 and low < 32 and name.lower() != 'reserved':
+					part.name += '_LO' if lo == 0 else '_HI'
+
+				if bit.reset_value is not None:
+					# reset values are of the field, not the register
+					shift = max (low, lo) - low
+					part.reset_value = (bit.reset_value >> shift) & ((1 << (part.bit_range[0] - part.bit_range[1] + 1)) - 1)
+
+				half.bits.append (part)
+
+		return halves
+
+	def fold_arrays (self):
+		# runs of registers that only differ by a number in their name, at a
+		# constant stride and with the same fields, go out as one dim array
+		# (e.g. ddr_rgn_con0..34 -> ddr_rgn_con%s); done up front so the
+		# render workers share it
+		self.folded = {}
+		for groupname in self.map:
+			if self.peripheral_registers.get (groupname):
+				self.folded[groupname] = self.fold_registers (self.kept_registers (groupname))
+
+	def fold_registers (self, registers):
+		# candidate arrays: the register name with one of its numbers taken out
+		candidates = {}
+		for reg in registers:
+			if reg.dim is not None or reg.size == 'DW' or len(reg.address_offsets) != 1:
 				continue
 
-			if len(self.peripheral_registers[groupname]) == 0:
+			if reg.name.lower() == 'reserved':
 				continue
 
-			peripherals_for_group = self.map[groupname]
+			for m in re.finditer ('\d+', reg.name):
+				name = reg.name[:m.start()] + '%s' + reg.name[m.end():]
+
+				# zero padded indexes wouldn't come back out the same
+				if name % int(m.group()) == reg.name:
+					candidates.setdefault (name, []).append ((int(m.group()), reg))
+
+		# biggest first, so CON0..CON9 goes by CON%s rather than by whatever
+		# other number is in its name
+		layouts = {}
+		arrays = {}
+		used = set()
+		for name in sorted (candidates, key=lambda name: -len(candidates[name])):
+			runs = []
+			for (index, reg) in sorted (candidates[name], key=lambda c: c[0]):
+				if id(reg) in used:
+					continue
 
-			# FIXME: well, since rust-svd doesn't support derivedFrom,
-			# build each one out manually
-			first_per = None
-			for per in peripherals_for_group:
-				p_xml = ET.SubElement (peripherals_xml, 'peripheral')
-				ET.SubElement (p_xml, 'name').text = per.name
-				ET.SubElement (p_xml, 'version').text = '1.0'
-				ET.SubElement (p_xml, 'groupname').text = groupname
-				ET.SubElement (p_xml, 'baseAddress').text = hex(per.base_addr)
+				if id(reg) not in layouts:
+					layouts[id(reg)] = self.register_layout (reg)
 
-				if first_per is None:
-					first_per = per
+				if runs and self.continues_array (runs[-1], index, reg, layouts):
+					runs[-1].append ((index, reg))
 				else:
-					# just mark as derivedFrom the previous one
-					# and keep going
-					p_xml.attrib['derivedFrom'] = first_per.name
+					runs.append ([(index, reg)])
+
+			# only one array can have the name, so the longest run gets it
+			run = max (runs, key=len, default=[])
+			if len(run) < 2:
+				continue
+
+			used.update (id(reg) for (index, reg) in run)
+			arrays[id(run[0][1])] = self.array_register (name, run)
+			print('Folded %d registers into array %s' % (len(run), name))
+
+		# the array goes where its first register was
+		folded = []
+		for reg in registers:
+			if id(reg) in arrays:
+				folded.append (arrays[id(reg)])
+			elif id(reg) not in used:
+				folded.append (reg)
+
+		return folded
+
+	def register_layout (self, reg):
+		# what has to match for registers to share one array entry
+		fields = []
+		for bit in reg.bits:
+			name, desc = self.field_name (reg, bit)
+
+			# named after the register itself (see field_name)
+			if name == reg.name:
+				name = None
+
+			fields.append ((tuple(bit.bit_range), bit.access_policy, name))
+
+		return (reg.size, reg.reset_value, tuple(fields))
+
+	def continues_array (self, run, index, reg, layouts):
+		(last_index, last) = run[-1]
+		if index != last_index + 1:
+			return False
+
+		stride = reg.address_offsets[0] - last.address_offsets[0]
+		if len(run) > 1:
+			if stride != run[1][1].address_offsets[0] - run[0][1].address_offsets[0]:
+				return False
+		elif stride < self.size_to_bits[reg.size] // 8:
+			return False
+
+		return layouts[id(reg)] == layouts[id(run[0][1])]
+
+	def array_register (self, name, run):
+		# the first register stands in for the rest
+		array = copy.copy (run[0][1])
+		array.name = name
+		array.dim = len(run)
+		array.dimIndex = '%d-%d' % (run[0][0], run[-1][0])
+		array.dimIncrement = run[1][1].address_offsets[0] - array.address_offsets[0]
+
+		return array
+
+	def wants_enums (self, groupname):
+		return 'ALL' in self.enum_groups or groupname in self.enum_groups
+
+	def field_enums (self, bit):
+		# {value: description} from the "2'b01: ..." / "1: ..." lines of a
+		# field's description; None unless there's at least two of them
+		width = bit.bit_range[0] - bit.bit_range[1] + 1
+		enums = {}
+		for line in bit.description.split('\n'):
+			m = re.match ("\s*(\d+)['\u2019]b([01]+): (.*)", line)
+			if m:
+				# bitstring format: 2'b01
+				if len(m.group(2)) != int(m.group(1)):
 					continue
 
+				val = int(m.group(2), 2)
+				desc = m.group(3)
+			else:
+				# just a regular integer value
+				m = re.match ("\s*(\d+): (.*)", line)
+				if not m:
+					continue
 
+				val = int(m.group(1))
+				desc = m.group(2)
 
-				# define the addressBlock
-				# we do this on a fine-grained level; each register is one addressBlock
-				# for reg in peripheral_registers[groupname]:
-					# addrblock = ET.SubElement (p_xml, 'addressBlock')
-					# ET.SubElement (addrblock, 
+			# doesn't fit the field, so it's not describing it
+			if val >= (1 << width):
+				continue
 
-				# at the moment, devices don't cause interrupts directly to CPU
-				# since they need to go via arbiter first, and be configured
+			enums[val] = desc.strip()
 
-				# do the registers
-				# if groupname not in self.peripheral_registers:
-				# in address map but not register map
-				# continue
+		if len(enums) < 2:
+			return None
 
-				registers_xml = ET.SubElement (p_xml, 'registers')
-				for reg in self.peripheral_registers[groupname]:
-					# FIXME: YUGE...  :(
-					if reg.size == 'DW':
-						print('WARNING: skipping register', reg, 'because svd2rust only supports up to 32-bits')
-						continue
+		return enums
 
-					# ignore reserved registers
-					if reg.name.lower() == 'reserved':
+	def enum_key (self, bit, enums):
+		# fields with the same width and values can share one enumeratedValues
+		return (bit.bit_range[0] - bit.bit_range[1], tuple(sorted (enums.items())))
+
+	def enum_value_names (self, enums):
+		# {value: name}, made up from the start of each value's description
+		names = {}
+		for val in sorted (enums):
+			# "clk_24m (default), ..." -> CLK_24M
+			text = re.split ('[,;.(]', enums[val], 1)[0]
+			name = '_'.join (re.findall ('[A-Za-z0-9]+', text)[:4]).upper()
+			if not name:
+				name = 'VALUE%d' % val
+			elif name[0].isdigit():
+				name = 'VAL_' + name
+
+			if name in names.values():
+				name = '%s_%d' % (name, val)
+
+			names[val] = name
+
+		return names
+
+	def collect_enums (self):
+		# which field defines each distinct set of enumerated values: the first
+		# one with it in the SVD, which the rest then derive from; done up front
+		# so the render workers agree on it
+		self.enum_defs = {}
+		for groupname in self.map:
+			if not self.wants_enums (groupname):
+				continue
+
+			if not self.peripheral_registers.get (groupname):
+				continue
+
+			per = self.map[groupname][0]
+			for reg in self.export_registers (groupname):
+				if reg.size == 'DW' and self.dw == 'skip':
+					continue
+
+				if reg.name.lower() == 'reserved' or reg.dim is not None:
+					continue
+
+				for bit in reg.bits:
+					name, desc = self.field_name (reg, bit)
+					if name.lower() == 'reserved':
 						continue
 
-					register_xml = ET.SubElement (registers_xml, 'register')
+					enums = self.field_enums (bit)
+					if enums is not None:
+						self.enum_defs.setdefault (self.enum_key (bit, enums), (per.name, reg.name, name.upper()))
 
-					ET.SubElement (register_xml, 'name').text = reg.name
+	def export_enums (self, field_xml, per, reg, name, bit):
+		enums = self.field_enums (bit)
+		if enums is None:
+			return
 
-					# FIXME: svd-parser assumes description must always have text
-					# don't know what happens if you just drop the field; can we even do that?
-					if reg.description:
-						ET.SubElement (register_xml, 'description').text = reg.description
-					else:
-						ET.SubElement (register_xml, 'description').text = reg.name
-
-					assert len(reg.address_offsets) == 1
-					ET.SubElement (register_xml, 'addressOffset').text = hex(reg.address_offsets[0])
-					
-					ET.SubElement (register_xml, 'size').text = str(self.size_to_bits[reg.size])
-
-					ET.SubElement (register_xml, 'resetValue').text = hex(reg.reset_value)
-
-					if reg.dim is not None:
-						ET.SubElement (register_xml, 'dim').text = str(reg.dim)
-						ET.SubElement (register_xml, 'dimIndex').text = reg.dimIndex
-						ET.SubElement (register_xml, 'dimIncrement').text = str(reg.dimIncrement)
-
-					# register size dependent
-					# FIXME: svd-parser assumes this field may be at most 32-bits
-					# and.. it shall be so :(
-					use_size = reg.size
-					if reg.size == 'DW':
-						use_size = 'W'
-
-					ET.SubElement (register_xml, 'resetMask').text = '0x' + ('F' * int(self.size_to_bits[use_size] / 4))
-					fields_xml = ET.SubElement (register_xml, 'fields')
-
-					for bit in reg.bits:
-						if 'name' not in bit.__dict__:
-							if '\n' in bit.description:
-								name, desc = bit.description.split('\n', 1)
-							else:
-								# FIXME: svd-parser assumption may also apply to this field?
-								name, desc = (bit.description, '')
-
-							if ' ' in name:
-								# no name; copy name from register
-								# but ONLY if it's the only one
-								if len(reg.bits) == 1:
-									desc = name
-									name = reg.name
-
-									# to handle arrays
-									if '%s' in name:
-										name = name.replace('%s', '')
-								else:
-									if bit.description in self.field_names:
-										name = self.field_names[bit.description]
-									else:
-										print('there are %d other bits' % len(reg.bits))
-										print("unknown name for this register:")
-										print(bit.description)
-										name = input("name for register? ")
-										self.field_names[bit.description] = name
-										self.dump_fields()
-
-									desc = bit.description
-						else:
-							name = bit.name
+		# named after the field it's defined on
+		path = (per.name, reg.name, name)
+		defined = self.enum_defs.setdefault (self.enum_key (bit, enums), path)
+		if defined != path:
+			ET.SubElement (field_xml, 'enumeratedValues', derivedFrom='.'.join (defined + (defined[2],)))
+			return
 
-						if not desc:
-							desc = bit.description
+		enums_xml = ET.SubElement (field_xml, 'enumeratedValues')
+		ET.SubElement (enums_xml, 'name').text = name
 
-						# ignore reserved fields
-						if name.lower() == 'reserved':
-							continue
+		names = self.enum_value_names (enums)
+		for val in sorted (enums):
+			enum_xml = ET.SubElement (enums_xml, 'enumeratedValue')
+			ET.SubElement (enum_xml, 'name').text = names[val]
+			ET.SubElement (enum_xml, 'description').text = enums[val] or names[val]
+			ET.SubElement (enum_xml, 'value').text = str(val)
 
-						# looks good; build it
-						field_xml = ET.SubElement (fields_xml, 'field')
+	def render_groups (self, jobs):
+		# (groupname, fragment, seconds) in map order
+		if jobs <= 1:
+			for groupname in self.map:
+				yield self.render_group (groupname)
 
-						ET.SubElement (field_xml, 'name').text = name.upper()
-						ET.SubElement (field_xml, 'description').text = desc
+			return
+
+		global exporting
+		exporting = self
 
-						# since idx 1 > 0, 0 becomes offset and we take the diff to do width
-						# ET.SubElement (field_xml, 'bitOffset').text = bit.bitrange[0]
-						# ET.SubElement (field_xml, 'bitWidth').text = bit.bitrange[1] - bit.bitrange[1]
-						ET.SubElement (field_xml, 'bitRange').text = '[%d:%d]' % (bit.bit_range)
+		ctx = multiprocessing.get_context ('fork')
+		with concurrent.futures.ProcessPoolExecutor (jobs, mp_context=ctx) as pool:
+			for result in pool.map (render_group, self.map):
+				yield result
 
-						# setup permissions
-						attrmap = self.access_policy_map[bit.access_policy]
-						for attr in attrmap:
-							ET.SubElement (field_xml, attr).text = attrmap[attr]
+	def render_group (self, groupname):
+		# one group's <peripheral>s, indented to sit inside <peripherals>
+		started = time.time ()
 
-						# TODO: calculate enumeratedValues where we can
-						enums = {}
-						for line in bit.description.split('\n'):
-							m = re.match ("\s+(\d+'b\d+): (.*)", line)
-							val = None
-							desc = None
+		chunks = []
+		for p_xml in self.group_elements (groupname):
+			ET.indent (p_xml, space='  ', level=2)
+			chunks.append (b'\n    ' + ET.tostring (p_xml))
 
-							if m:
-								# bitstring format: 2'b01
-								bitstr_withprefix = m.group(1)
-								prefix, bitstr = bitstr_withprefix.split ('b')
-								assert prefix[-1] == "'"
+		return (groupname, b''.join (chunks), time.time () - started)
 
-								prefix = prefix[:-1]
-								assert len(bitstr) == int(prefix)
+	def write_element (self, xf, elem, level):
+		# indent elem as pretty_print would have, level elements deep
+		ET.indent (elem, space='  ', level=level)
+		xf.write ('\n' + '  ' * level)
+		xf.write (elem)
 
-								val = int(bitstr, 2)
-								desc = m.group(2)
-							else:
-								m = re.match ("\s+(\d+): (.*)", line)
-								if m:
-									# just a regular integer value
-									val = int(m.group(1))
-									desc = m.group(2)
+	def group_elements (self, groupname):
+		if groupname not in self.peripheral_registers:
+			return
+
+		if len(self.peripheral_registers[groupname]) == 0:
+			return
 
-							if val is not None:
-								enums[val] = desc
+		peripherals_for_group = self.map[groupname]
 
-						# if enums:
-						# 	enums_xml = ET.SubElement (field_xml, 'enumeratedValues')
-						# 	for enum_key in enums:
-						# 		enum_xml = ET.SubElement (enums_xml, 'enumeratedValue')
-						# 		ET.SubElement (enum_xml, 'name').text = enum_key
+		# FIXME: well, since rust-svd doesn't support derivedFrom,
+		# build each one out manually
+		first_per = None
+		for per in peripherals_for_group:
+			p_xml = ET.Element ('peripheral')
+			ET.SubElement (p_xml, 'name').text = per.name
+			ET.SubElement (p_xml, 'version').text = '1.0'
+			ET.SubElement (p_xml, 'groupname').text = groupname
+			ET.SubElement (p_xml, 'baseAddress').text = hex(per.base_addr)
 
-						# 		# try to work out what to do with desc
-						# 		d = enums[enum_key]
-						# 		if 
-						# 		ET.SubElement (enum_xml, 'name').text = enum_key
+			if first_per is None:
+				first_per = per
+			else:
+				# just mark as derivedFrom the previous one
+				# and keep going
+				p_xml.attrib['derivedFrom'] = first_per.name
+				yield p_xml
+				continue
 
 
 
-			# for otherper in peripherals_for_group[1:]:
-			# 	other_p_xml = ET.SubElement (peripherals_xml, 'peripheral')
+			# define the addressBlock
+			# we do this on a fine-grained level; each register is one addressBlock
+			# for reg in peripheral_registers[groupname]:
+				# addrblock = ET.SubElement (p_xml, 'addressBlock')
+				# ET.SubElement (addrblock, 
 
-			# 	ET.SubElement (other_p_xml, 'derivedFrom').text = firstper.name
-			# 	ET.SubElement (other_p_xml, 'name').text = otherper.name
-			# 	ET.SubElement (other_p_xml, 'version').text = '1.0'
-			# 	ET.SubElement (other_p_xml, 'groupname').text = groupname
-			# 	ET.SubElement (other_p_xml, 'baseAddress').text = hex(otherper.base_addr)
+			# at the moment, devices don't cause interrupts directly to CPU
+			# since they need to go via arbiter first, and be configured
 
+			# do the registers
+			# if groupname not in self.peripheral_registers:
+			# in address map but not register map
+			# continue
 
-		return ET.tostring (root, pretty_print=True)
+			registers_xml = ET.SubElement (p_xml, 'registers')
+			for reg in self.export_registers (groupname):
+				# FIXME: YUGE...  :(
+				if reg.size == 'DW' and self.dw == 'skip':
+					print('WARNING: skipping register', reg, 'because svd2rust only supports up to 32-bits (see --dw)')
+					continue
 
-if __name__ == '__main__':
-	if len(sys.argv) != 3:
-		sys.stderr.write('usage: %s <ap|m0> <target.svd>\n' % sys.argv[0])
-		sys.exit(1)
+				# ignore reserved registers
+				if reg.name.lower() == 'reserved':
+					continue
+
+				register_xml = ET.SubElement (registers_xml, 'register')
+
+				ET.SubElement (register_xml, 'name').text = reg.name
+
+				# FIXME: svd-parser assumes description must always have text
+				# don't know what happens if you just drop the field; can we even do that?
+				if reg.description:
+					ET.SubElement (register_xml, 'description').text = reg.description
+				else:
+					ET.SubElement (register_xml, 'description').text = reg.name
+
+				assert len(reg.address_offsets) == 1
+				ET.SubElement (register_xml, 'addressOffset').text = hex(reg.address_offsets[0])
+				
+				ET.SubElement (register_xml, 'size').text = str(self.size_to_bits[reg.size])
+
+				ET.SubElement (register_xml, 'resetValue').text = hex(reg.reset_value)
+
+				if reg.dim is not None:
+					ET.SubElement (register_xml, 'dim').text = str(reg.dim)
+					ET.SubElement (register_xml, 'dimIndex').text = reg.dimIndex
+					ET.SubElement (register_xml, 'dimIncrement').text = str(reg.dimIncrement)
+
+				# register size dependent; only 64 bits with --dw native
+				ET.SubElement (register_xml, 'resetMask').text = '0x' + ('F' * int(self.size_to_bits[reg.size] / 4))
+				fields_xml = ET.SubElement (register_xml, 'fields')
+
+				for bit in reg.bits:
+					name, desc = self.field_name (reg, bit)
 
-	b = Builder (sys.argv[1].upper())
-	with open (sys.argv[2], 'wb') as f:
-		f.write (b.export ())
+					# ignore reserved fields
+					if name.lower() == 'reserved':
+						continue
+
+					# looks good; build it
+					field_xml = ET.SubElement (fields_xml, 'field')
+
+					ET.SubElement (field_xml, 'name').text = name.upper()
+					ET.SubElement (field_xml, 'description').text = desc
+
+					# since idx 1 > 0, 0 becomes offset and we take the diff to do width
+					# ET.SubElement (field_xml, 'bitOffset').text = bit.bitrange[0]
+					# ET.SubElement (field_xml, 'bitWidth').text = bit.bitrange[1] - bit.bitrange[1]
+					ET.SubElement (field_xml, 'bitRange').text = '[%d:%d]' % (bit.bit_range)
+
+					# setup permissions
+					attrmap = self.access_policy_map[bit.access_policy]
+					for attr in attrmap:
+						ET.SubElement (field_xml, attr).text = attrmap[attr]
+
+					if self.wants_enums (groupname) and reg.dim is None:
+						self.export_enums (field_xml, per, reg, name.upper(), bit)
+
+			yield p_xml
+
+		# for otherper in peripherals_for_group[1:]:
+		# 	other_p_xml = ET.SubElement (peripherals_xml, 'peripheral')
+
+		# 	ET.SubElement (other_p_xml, 'derivedFrom').text = firstper.name
+		# 	ET.SubElement (other_p_xml, 'name').text = otherper.name
+		# 	ET.SubElement (other_p_xml, 'version').text = '1.0'
+		# 	ET.SubElement (other_p_xml, 'groupname').text = groupname
+		# 	ET.SubElement (other_p_xml, 'baseAddress').text = hex(otherper.base_addr)
+
+
+# builders for `all`, inherited by the forked export workers
+targets = {}
+
+# the builder rendering groups, inherited by the forked render workers
+exporting = None
+
+def render_group (groupname):
+	return exporting.render_group (groupname)
+
+def export_target (name, fname, jobs, db=False):
+	with open (fname, 'wb') as f:
+		targets[name].export (f, jobs)
+
+	if db:
+		regdb.write (fname, regdb_name (fname))
+
+	return fname
+
+def regdb_name (svd):
+	return os.path.splitext (svd)[0] + '.regdb'
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser ()
+	parser.add_argument ('target', choices=['ap', 'm0', 'all'])
+	parser.add_argument ('svd', nargs='?', help='target SVD, or output directory for all')
+	parser.add_argument ('--no-cache', action='store_true',
+		help="don't use or update the cached parse in .cache/")
+	parser.add_argument ('--keep-going', action='store_true',
+		help='export even if the parse found errors')
+	parser.add_argument ('-j', '--jobs', type=int, default=os.cpu_count (),
+		help='processes to render the peripheral groups with (default: %(default)s)')
+	parser.add_argument ('--batch-fields', action='store_true',
+		help="don't ask for field names; make them up, and write them to data/fields-review.json to check")
+	parser.add_argument ('--fold-arrays', action='store_true',
+		help='export numbered registers with the same fields, at a constant stride, as dim arrays')
+	parser.add_argument ('--dw', choices=['skip', 'native', 'split'], default='skip',
+		help='export 64-bit registers as they are (native), as two 32-bit halves (split), or not at all (the default)')
+	parser.add_argument ('--regdb', action='store_true',
+		help='also write a binary register database (see regdb.py) next to each SVD')
+	parser.add_argument ('--drop-overlaps', action='store_true',
+		help='leave out registers that overlap an earlier one in the same peripheral')
+	parser.add_argument ('--decode', metavar='ADDR', action='append', type=lambda a: int(a, 0),
+		help="print the peripheral, register and fields at ADDR (instead of exporting); may be repeated")
+	parser.add_argument ('--coverage', metavar='FILE',
+		help='write which bits of each register are defined, overlap and reset to 1, as JSON')
+	parser.add_argument ('--enums', metavar='GROUPS', default='',
+		help="export enumeratedValues for these peripheral groups (comma separated, or 'all')")
+	args = parser.parse_args ()
+
+	if args.decode and args.target == 'all':
+		parser.error ('--decode needs a single target')
+
+	if not args.decode and args.svd is None:
+		parser.error ('the svd argument is required')
+
+	enum_groups = set (g for g in args.enums.upper().split (',') if g)
+
+	if args.target != 'all':
+		b = Builder (args.target.upper(), cache=not args.no_cache, keep_going=args.keep_going)
+		b.enum_groups = enum_groups
+		b.fold = args.fold_arrays
+		b.dw = args.dw
+		b.drop_overlaps = args.drop_overlaps
+
+		if args.coverage:
+			b.coverage_report (args.coverage)
+
+		if args.decode:
+			for addr in args.decode:
+				print('\n'.join (b.decode (addr)))
+
+			sys.exit (0)
+
+		# ask for any field names up front (workers can't)
+		b.name_fields (args.batch_fields)
+
+		with open (args.svd, 'wb') as f:
+			b.export (f, args.jobs)
+
+		if args.regdb:
+			regdb.write (args.svd, regdb_name (args.svd))
+
+		sys.exit (0)
+
+	# parse once, then just redo the map for every other core
+	names = list(Builder.systems)
+	b = Builder (names[0], cache=not args.no_cache, keep_going=args.keep_going)
+	b.enum_groups = enum_groups
+	b.fold = args.fold_arrays
+	b.dw = args.dw
+	b.drop_overlaps = args.drop_overlaps
+
+	if args.coverage:
+		b.coverage_report (args.coverage)
+
+	for name in names:
+		targets[name] = b if name == b.name else b.retarget (name)
+
+	# workers can't ask for field names, so do that here first
+	b.name_fields (args.batch_fields)
+
+	if not os.path.exists (args.svd):
+		os.makedirs (args.svd)
+
+	ctx = multiprocessing.get_context ('fork')
+	with concurrent.futures.ProcessPoolExecutor (len(targets), mp_context=ctx) as pool:
+		jobs = max (1, args.jobs // len(targets))
+		futures = [pool.submit (export_target, name, os.path.join (args.svd, 'rk3399-%s.svd' % name.lower()), jobs, args.regdb) for name in targets]
+		for future in futures:
+			print('wrote', future.result ())
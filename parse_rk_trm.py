@@ -2,6 +2,13 @@ import lxml.etree as ET
 import re
 import sys
 import codecs
+import resource
+import os
+import io
+import json
+import html
+import time
+import collections
 # sys.stdout = codecs.getwriter('utf8')(sys.stdout)
 
 class Interrupt(object):
@@ -22,6 +29,59 @@ class BitAccess(object):
 	def __repr__ (self):
 		return '%r (%s)' % (self.bit_range, self.description.split('\n')[0])
 
+# which bits of a register its fields cover (defined), cover more than once
+# (overlap), and reset to 1 (reset, out of the ones with a reset value:
+# known); as masks, so it's one pass over the fields, whatever the width
+class Coverage (object):
+	def __init__ (self, bits, width):
+		self.width = width
+		self.defined = 0
+		self.overlap = 0
+		self.reset = 0
+		self.known = 0
+		self.backwards = []
+
+		for ba in bits:
+			(hi, lo) = ba.bit_range
+			if hi < lo:
+				self.backwards.append (ba)
+				(hi, lo) = (lo, hi)
+
+			mask = ((1 << (hi - lo + 1)) - 1) << lo
+			self.overlap |= self.defined & mask
+			self.defined |= mask
+
+			if ba.reset_value is not None:
+				self.known |= mask
+				self.reset |= (ba.reset_value << lo) & mask
+
+	def gaps (self):
+		return ((1 << self.width) - 1) & ~self.defined
+
+	def outside (self):
+		# past the top of the register
+		return self.defined >> self.width << self.width
+
+	def to_json (self):
+		return [self.width] + ['0x%x' % mask for mask in (self.defined, self.overlap, self.reset, self.known)]
+
+def mask_ranges (mask):
+	# "31:16, 3" for the bits set in mask
+	ranges = []
+	bit = 0
+	while mask >> bit:
+		if not (mask >> bit) & 1:
+			bit += 1
+			continue
+
+		lo = bit
+		while (mask >> bit) & 1:
+			bit += 1
+
+		ranges.insert (0, '%d:%d' % (bit - 1, lo) if bit - 1 != lo else '%d' % lo)
+
+	return ', '.join (ranges)
+
 class Register(object):
 	def __init__(self, name):
 		super(Register, self).__init__()
@@ -30,6 +90,9 @@ class Register(object):
 		self.address_offsets = []
 		self.description = None
 
+		# where in the TRM we found it, for diagnostics
+		self.page = None
+
 		# set in svd script
 		self.size = None
 		self.reset_value = None
@@ -38,6 +101,68 @@ class Register(object):
 	def __repr__ (self):
 		return self.name
 
+# a peripheral's registers, in order, but indexed by name; merging looks up
+# (and sometimes removes) every detail register by name, and blocks like
+# the DDR PHY have hundreds of them
+#
+# behaves like the list it replaces, duplicates and all
+class RegisterList (object):
+	def __init__ (self, registers=()):
+		self.registers = {}	# insertion number -> register, in order
+		self.names = {}		# name -> [insertion number], in order
+		self.count = 0
+
+		for reg in registers:
+			self.append (reg)
+
+	def __len__ (self):
+		return len(self.registers)
+
+	def __iter__ (self):
+		return iter (self.registers.values ())
+
+	def __repr__ (self):
+		return repr (list (self))
+
+	def append (self, reg):
+		self.registers[self.count] = reg
+		self.names.setdefault (reg.name, []).append (self.count)
+		self.count += 1
+
+	def get (self, name):
+		# first register called name, or None
+		keys = self.names.get (name)
+		if not keys:
+			return None
+
+		return self.registers[keys[0]]
+
+	def remove (self, reg):
+		# the first occurrence of reg itself, like list.remove
+		keys = self.names.get (reg.name, [])
+		for key in keys:
+			if self.registers[key] is reg:
+				break
+		else:
+			raise ValueError ('%s not in register list' % reg.name)
+
+		del self.registers[key]
+		keys.remove (key)
+		if not keys:
+			del self.names[reg.name]
+
+	def rename (self, reg, name):
+		keys = self.names.get (reg.name, [])
+		for key in [x for x in keys if self.registers[x] is reg]:
+			keys.remove (key)
+			self.names.setdefault (name, []).append (key)
+			self.names[name].sort ()
+
+		if not keys:
+			self.names.pop (reg.name, None)
+
+		reg.name = name
+
 class RegisterSummary(object):
 	def __init__(self, name):
 		self.name = name
@@ -46,711 +171,1132 @@ class RegisterSummary(object):
 		self.reset_value = None
 		self.description = None
 
+def peak_rss ():
+	# ru_maxrss is in KiB on linux
+	return resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+
+class RegisterSection (object):
+	def __init__ (self, first_page):
+		# pages are indexes into PageIndex.pages, inclusive
+		self.first_page = first_page
+		self.last_page = first_page
+
+		# register name prefix (ie. peripheral) -> number of mentions
+		self.prefixes = {}
+
+	def __repr__ (self):
+		return 'pages %d-%d %r' % (self.first_page, self.last_page, sorted(self.prefixes))
+
+# byte offsets of each <page> and section heading in a pdftohtml dump, so
+# we can pull out a single peripheral's tables without parsing the rest
+#
+# relies on pdftohtml putting each <page> and <text> on its own line
+class PageIndex (object):
+	VERSION = 1
+
+	def __init__ (self, fname):
+		self.fname = fname
+
+		self.pages = []		# [(page number, byte offset)]
+		self.headings = []	# [(index into pages, byte offset, text)]
+		self.sections = []	# [RegisterSection]
+		self.end = None		# byte offset of </pdf2xml>
+
+	@classmethod
+	def load (cls, fname):
+		# reuse the index next to the source, unless the source has changed
+		idx = cls (fname)
+		idx_fname = fname + '.index.json'
+		st = os.stat (fname)
+		stamp = [cls.VERSION, st.st_size, st.st_mtime]
+
+		if os.path.exists (idx_fname):
+			with open (idx_fname, 'r') as f:
+				saved = json.load (f)
+
+			if saved['stamp'] == stamp:
+				idx.pages = [tuple(x) for x in saved['pages']]
+				idx.headings = [tuple(x) for x in saved['headings']]
+				idx.end = saved['end']
+				for s in saved['sections']:
+					section = RegisterSection (s['first_page'])
+					section.last_page = s['last_page']
+					section.prefixes = s['prefixes']
+					idx.sections.append (section)
+
+				return idx
+
+		idx.build ()
+
+		with open (idx_fname, 'w') as f:
+			json.dump ({
+				'stamp': stamp,
+				'pages': idx.pages,
+				'headings': idx.headings,
+				'end': idx.end,
+				'sections': [x.__dict__ for x in idx.sections]
+			}, f)
+
+		return idx
+
+	def build (self):
+		page_re = re.compile (rb'<page number="(\d+)"')
+		tag_re = re.compile (rb'<[^>]*>')
+		regname_re = re.compile (r'([A-Z][A-Z0-9]*)_[0-9A-Z_n~]*$')
+
+		section = None
+		offset = 0
+
+		with open (self.fname, 'rb') as f:
+			for line in f:
+				stripped = line.lstrip ()
+				if stripped.startswith (b'<page'):
+					self.pages.append ((int(page_re.match (stripped).group (1)), offset))
+				elif stripped.startswith (b'<text') and (section is not None or b'font="14"' in stripped):
+					text = html.unescape (tag_re.sub (b'', stripped).decode ('utf-8')).strip ()
+
+					if b'font="14"' in stripped:
+						page = len(self.pages) - 1
+						self.headings.append ((page, offset, text))
+
+						if 'Register Summary' in text or 'Registers Summary' in text:
+							if section is not None:
+								section.last_page = page
+
+							section = RegisterSection (page)
+							self.sections.append (section)
+						elif 'Detail Register Description' in text:
+							if section is None:
+								section = RegisterSection (page)
+								self.sections.append (section)
+						elif section is not None:
+							# some other section; we're done
+							section.last_page = page
+							section = None
+					elif text:
+						m = regname_re.match (text.split (' ', 1)[0])
+						if m:
+							prefix = m.group (1)
+							section.prefixes[prefix] = section.prefixes.get (prefix, 0) + 1
+				elif stripped.startswith (b'</pdf2xml>'):
+					self.end = offset
+
+				offset += len(line)
+
+		if self.end is None:
+			self.end = offset
+
+		if section is not None:
+			section.last_page = len(self.pages) - 1
+
+	def sections_for (self, pname):
+		return [x for x in self.sections if pname in x.prefixes]
+
+	def page_span (self, first, last):
+		# raw bytes for pages first..last inclusive, as a standalone document
+		start = self.pages[first][1]
+		if last + 1 < len(self.pages):
+			end = self.pages[last + 1][1]
+		else:
+			end = self.end
+
+		with open (self.fname, 'rb') as f:
+			f.seek (start)
+			data = f.read (end - start)
+
+		return b'<pdf2xml>\n' + data + b'</pdf2xml>\n'
+
+REGISTER_SIZES = ('W', 'HW', 'DW', 'B')
+ACCESS_POLICIES = ('RW', 'RO', 'WO', 'W1C', 'RC')
+
+WHITESPACE_RE = re.compile (r'\s+')
+COPYRIGHT_RE = re.compile (r'Copyright \d{4} @ .* (\d+)')
+SUMMARY_REGNAME_RE = re.compile (r'[0-9A-Z_n]+[0-9A-Z_n]*[0-9A-Z_]*')
+OFFSET_RE = re.compile (r'Operational Base \+ offset \(0x([A-Fa-f0-9]+)\)')
+OFFSET_SHORT_RE = re.compile (r'Operational Base\+0x([A-Fa-f0-9]+)')
+OFFSET_RANGE_RE = re.compile (r'Operational Base \+ offset \(0x([A-Fa-f0-9]+)~0x([A-Fa-f0-9]+)\)')
+
+# raised by the table states when the document isn't laid out how we
+# expect; parse() catches it and skips the rest of the table
+class TableError (Exception):
+	pass
+
+def expect (cond, message):
+	if not cond:
+		raise TableError (message)
+
+class Diagnostic (object):
+	def __init__ (self, severity, message, source=None, page=None, state=None, text=None):
+		self.severity = severity
+		self.message = message
+		self.source = source
+		self.page = page
+		self.state = state
+		self.text = text
+
+	def __repr__ (self):
+		where = []
+		if self.source:
+			where.append (os.path.basename (self.source))
+		if self.page is not None:
+			where.append ('page %s' % self.page)
+		if self.state:
+			where.append ('in %s' % self.state)
+
+		s = '%s: %s' % (self.severity.upper (), self.message)
+		if where:
+			s += ' (%s)' % ', '.join (where)
+		if self.text:
+			s += ': %r' % self.text
+		return s
+
+	def to_json (self):
+		return {
+			'severity': self.severity,
+			'message': self.message,
+			'source': self.source,
+			'page': self.page,
+			'state': self.state,
+			'text': self.text,
+		}
+
+# everything odd we found while parsing, so one run finds all the problems
+# rather than stopping at the first
+class Diagnostics (object):
+	def __init__ (self, source=None):
+		self.source = source
+		self.items = []
+
+	def add (self, severity, message, t=None, state=None, page=None):
+		text = None
+		if t is not None:
+			text = ''.join (t.elem.itertext ()).strip ()
+			if page is None:
+				page = t.page
+
+		d = Diagnostic (severity, message, self.source, page, state, text)
+		self.items.append (d)
+		print(d)
+		return d
+
+	def warning (self, message, t=None, state=None, page=None):
+		return self.add ('warning', message, t, state, page)
+
+	def error (self, message, t=None, state=None, page=None):
+		return self.add ('error', message, t, state, page)
+
+	def errors (self):
+		return [x for x in self.items if x.severity == 'error']
+
+	def warnings (self):
+		return [x for x in self.items if x.severity == 'warning']
+
+	def extend (self, other):
+		self.items += other.items
+
+	def summary (self):
+		return '%d errors, %d warnings' % (len (self.errors ()), len (self.warnings ()))
+
+	def report (self, fname):
+		with open (fname, 'w') as f:
+			json.dump ([x.to_json () for x in self.items], f, indent=1)
+
+# a <text> element, with the bits of it every state wants pulled out once
+class TextElement (object):
+	__slots__ = ('elem', 'font', 'left', 'bold', 'headings')
+
+	def __init__ (self, elem):
+		self.elem = elem
+		self.font = elem.get ('font')
+		self.left = elem.get ('left')
+		self.bold = elem.findall ('b')
+		self.headings = [(x.text or '').strip() for x in self.bold]
+
+	@property
+	def page (self):
+		# only looked up when something goes wrong; the footer's page
+		# number (ParseState.pagenum) lags a page behind
+		page = self.elem.getparent ()
+		if page is None or page.get ('number') is None:
+			return None
+		return int (page.get ('number'))
+
+# where we're up to in the document; tables carry over between pages,
+# so this does too
+class ParseState (object):
+	def __init__ (self):
+		self.parsing = None
+		self.pagenum = 0
+
+		# the state handling the current element, for diagnostics
+		self.state = None
+
+		# states we expect the next elements to be in, in order
+		self.stack = collections.deque ()
+
+		self.current_register = None
+		self.current_register_summary = None
+		self.sum_desc_col = 0
+		self.sum_name_col = 0
+		self.summary_range = None
+
+		self.current_bits = None
+		self.desc_col = None
+		self.partial_access_policy = ''
+
+	def pop (self):
+		if self.stack:
+			return self.stack.popleft ()
+
+		return None
+
+	def push (self, *states):
+		# have the next element(s) handled as these states first
+		self.stack.extendleft (reversed (states))
+
+	def replace (self, *states):
+		self.stack = collections.deque (states)
+
 # pdftohtml -s -i -noframes -xml Rockchip\ RK3399TRM\ V1.3\ Part1.pdf part1.xml
 class Parser (object):
-	def __init__ (self):
+	def __init__ (self, streaming=True):
 		self.registers = []
 		self.register_summaries = []
 
-	def parse (self, filelike):
-		current_register = None
-		current_register_summary = None
-		sum_desc_col = 0
-		sum_name_col = 0
-		summary_range = None
-		parsing = None
+		# free each element once we've handled it, rather than keeping the
+		# whole (multi-hundred MB) document tree around until we're done
+		self.streaming = streaming
 
-		pagenum = 0
-		iterparse = ET.iterparse(filelike)
-		consume_stack = []
-
-		current_bits = None
-		desc_col = None
-		partial_access_policy = ''
-
-		skip = 0
+		self.diagnostics = Diagnostics ()
 
+	def stream (self, iterparse):
 		for event, elem in iterparse:
-			# wtf next() is supposed to update the interator state
-			# why do i have to do this... :(
-			if skip:
-				skip -= 1
+			yield event, elem
+
+			# by the time we get back here, parse() is done with elem
+			if not self.streaming:
 				continue
-				
+
 			if elem.tag == 'text':
-				# ignore header and footer since they're always same
-				if elem.attrib['font'] == '0':
-					continue
-
-				if elem.attrib['font'] == '1':
-					# grab pagenum
-					footer = elem.find ('i').text
-					m = re.match ('Copyright \d{4} @ .* (\d+)', footer)
-					if m:
-						pagenum = int (m.group (1))
-					else:
-						if footer.startswith ('Notes:'):
-							# hit the notes at the bottom of table
-							# so table must be done; clear it to stop
-							consume_stack = []
-
-					continue
-
-				if elem.attrib['font'] == '14':
-					header_text = elem.find('b').text.strip()
-					# print 'ht', header_text
-					if 'Detail Register Description' in header_text:
-						consume_stack = []
-						parsing = 'detail-reg'
-					elif 'Register Summary' in header_text or 'Registers Summary' in header_text:
-						consume_stack = ['heading-n', 'heading-osr', 'heading-d', 'sumreg']
-						parsing = 'summary-reg'
-						continue
-					else:
-						# try without heading bit
-						header_text = elem.find('b').tail
-						if header_text:
-							# print 'ht-nobold', header_text
-							if 'Detail Register Description' in header_text:
-								consume_stack = []
-								parsing = 'detail-reg'
-							elif 'Register Summary' in header_text or 'Registers Summary' in header_text:
-								consume_stack = ['heading-n', 'heading-osr', 'heading-d', 'sumreg']
-								parsing = 'summary-reg'
-								continue
-							else:
-								parsing = None
-						else:
-							# print '\tno non-bold text either'
-							parsing = None
-							continue
-
-				if elem.attrib['font'] == '5':
-					header_text = elem.find('b').text.strip()
-					if 'register' in header_text:
-						# print "PI REG GO"
-						consume_stack = ['heading-n', 'heading-osr', 'heading-d', 'sumreg']
-						continue
-
-				if parsing == 'summary-reg':
-					if consume_stack:
-						consume = consume_stack.pop (0)
-						# print 'doing', consume
-					else:
-						consume = None
-
-					if consume == 'heading-n':
-						if elem.attrib['font'] == '3':
-							# print '\tskipping size 3 font...'
-							# print '\t', elem.text
-							if elem.find('b') is None:
-								consume_stack = ['heading-n'] + consume_stack
-								continue
-							else:
-								assert False
-
-						if elem.attrib['font'] != '5':
-							print("WARNING: skipping some register summary table")
-							print("because it doesn't match our format (font was %s)" % elem.attrib['font'])
-							consume_stack = []
-							continue
-
-						# assert elem.attrib['font'] == '5'
-						if elem.find('b').text.strip() != 'Name':
-							print('WARNING: found table not in right format')
-							consume_stack = []
-							continue
-
-						assert len(elem.findall('b')) == 1
-					elif consume == 'heading-osr':
-						# print elem.findall('b')
-						if len(elem.findall('b')) == 1:
-							headings = re.sub('\s+', ' ', elem.find('b').text).strip().split(' ')
-							if len(headings) == 2:
-								consume_stack = ['heading-r'] + consume_stack
-							elif len(headings) == 1:
-								consume_stack = ['heading-sr'] + consume_stack
-							else:
-								assert len(headings) == 3
-
-						elif len(elem.findall('b')) == 2:
-							consume_stack = ['heading-r'] + consume_stack
-						else:
-							assert len(elem.findall('b')) == 3
-					elif consume == 'heading-sr':
-						if len(elem.findall('b')) == 1:
-							headings = list(map (str.strip, elem.find ('b').text.split(' ', 1)))
-							assert headings == ['Size', 'Reset Value']
-						else:
-							assert len(elem.findall('b')) == 2
-							assert elem.find('b').text.strip() == 'Size'
-					elif consume == 'heading-r':
-						assert elem.find('b').text.strip() == 'Reset'
-						assert len(elem.findall('b')) == 1
-					elif consume == 'heading-d':
-						if elem.find('b').text.strip() == 'Value':
-							# eugh, from previous text node; do us again
-							consume_stack = ['heading-d'] + consume_stack
-						else:
-							assert elem.find('b').text.strip() == 'Description'
-							assert len(elem.findall('b')) == 1
-					elif consume == 'sumreg' or (consume == 'sumreg-d' and elem.attrib['left'] == sum_name_col):
-						# guard
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if len(headings) == 1 and 'Name' in headings[0]:
-							consume_stack = ['heading-osr', 'heading-d', 'sumreg']
-							continue
-
-						if sum_desc_col and elem.attrib['left'] == sum_desc_col:
-							# print '\tadded to description:', elem.text.strip()
-							current_register_summary.description += ' ' + elem.text.strip()
-							consume_stack = ['sumreg']
-						else:
-							if not elem.text:
-								# no more registers
-								consume_stack = []
-								continue
-
-							vals = re.sub ('\s+', ' ', elem.text.strip()).split(' ', 4)
-							
-							regname_arr = []
-							this_offset = None
-							this_size = None
-							this_reset = None
-							this_desc = None
-
-							# print '\t', vals
-
-							for v in vals:
-								if v.startswith ('0x') and this_offset is None:
-									this_offset = int(v, 16)
-								else:
-									if this_offset is not None:
-										# do this only after we have offset
-										if this_size is None:
-											this_size = v
-										elif this_reset is None:
-											this_reset = v
-										else:
-											this_desc = v
-									else:
-										# still name
-										regname_arr.append (v)
-
-							# no name found, screw it
-							if not regname_arr[0]:
-								continue
-
-							regname_str = ' '.join (regname_arr)
-
-							if not re.match (r'[0-9A-Z_n]+[0-9A-Z_n]*[0-9A-Z_]*', regname_str):
-								current_register_summary.description += regname_str
-								consume_stack = ['sumreg']
-								continue
-							elif ' ' in regname_str:
-								# for now, disallow spaces in register
-								print('\tWARNING: had space, skipping')
-								#current_register_summary.description += regname_str
-								consume_stack = ['sumreg']
-								continue
-
-							r = RegisterSummary (regname_str)
-							current_register_summary = r
-
-							if this_offset is not None:
-								r.offset_range = (this_offset, this_offset)
-
-							if this_size:
-								assert this_size in ['W', 'HW', 'DW', 'B']
-								r.size = this_size
-
-							if this_reset:
-								# print this_reset
-								assert this_reset[:2] == '0x'
-								r.reset_value = int(this_reset[2:], 16)
-
-							if this_desc:
-								r.description = this_desc.strip()
-
-							# print '\tnew register', regname_str
-							# if regname_str == 'PMUCRU_PPLL_CON1':
-							# 	sys.exit (1)
-
-							sum_name_col = elem.attrib['left']
-							sum_desc_col = None
-							self.register_summaries.append (r)
-
-							if this_offset is None:
-								consume_stack = ['sumreg-osrd']
-							elif this_size is None:
-								consume_stack = ['sumreg-srd']
-							elif this_reset is None:
-								consume_stack = ['sumreg-rd']
-							elif this_desc is None:
-								consume_stack = ['sumreg-d']
-							else:
-								consume_stack = ['sumreg']
-								
-					elif consume == 'sumreg-osrd':
-						# guard
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if len(headings) == 1 and 'Name' in headings[0]:
-							assert False
-							consume_stack = ['sumreg-n', 'sumreg-osr', 'sumreg-d'] + consume_stack
-							continue
-
-						if elem.attrib['left'] == sum_name_col:
-							# name clipped; go again
-							# print '\tname clipped, adding', elem.text.strip()
-							current_register_summary.name += elem.text.strip()
-							consume_stack = ['sumreg-osrd']
-							continue
-
-						elem.text = re.sub ('\s+', ' ', elem.text)
-						vals = list(map(str.strip, elem.text.strip().split(' ', 3)))
-
-						# print '\t', vals
-						assert vals[0][:2] == '0x'
-						if vals[0].endswith ('~'):
-							# print '\trange'
-							summary_range = vals[0][2:-1]
-							assert len(vals) == 1 # rely 100% on next step to do this
-							consume_stack = ['sumreg-range', 'sumreg-srd']
-							continue
-						else:
-							summary_range = None
-							current_register_summary.offset_range = (int(vals[0][2:], 16), int(vals[0][2:], 16))
-
-						if len(vals) == 1:
-							consume_stack = ['sumreg-srd']
-						else:
-							vals.pop(0)
-
-							assert vals[0] in ['W', 'HW', 'DW', 'B']
-							current_register_summary.size = vals[0]
-
-							vals.pop(0)
-
-							if vals:
-								# had reset value
-								assert vals[0].startswith ('0x')
-								current_register_summary.reset_value = int(vals[0][2:], 16)
-								vals.pop (0)
-
-								if vals:
-									# also had desc!
-									current_register_summary.description = vals[0]
-									consume_stack = ['sumreg']
-								else:
-									consume_stack = ['sumreg-d']
-							else:
-								consume_stack = ['sumreg-rd']
-					elif consume == 'sumreg-range':
-						# sometimes split over 2 lines; called by sumreg-osrd
-						elem.text = re.sub ('\s+', ' ', elem.text)
-						vals = list(map(str.strip, elem.text.strip().split(' ')))
-						assert len(vals) == 1
-
-						assert vals[0][:2] == '0x'
-						current_register_summary.offset_range = (int(summary_range, 16), int(vals[0][2:], 16))
-
-
-					elif consume == 'sumreg-srd':
-						# guard
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if len(headings) == 1 and 'Name' in headings[0]:
-							assert False
-							consume_stack = ['sumreg-n', 'sumreg-osr', 'sumreg-d'] + consume_stack
-							continue
-
-						elem.text = re.sub ('\s+', ' ', elem.text)
-						vals = list(map(str.strip, elem.text.strip().split(' ', 2)))
-						# print '\tsrd', vals
-
-						if vals[0].startswith ('~0x'):
-							# range from last field
-							current_register_summary.offset_range = (
-								current_register_summary.offset_range[0],
-								int (vals[0][3:], 16))
-
-							# try again
-							consume_stack = ['sumreg-srd'] + consume_stack
-							continue
-						
-						assert vals[0] in ['W', 'HW', 'DW', 'B']
-						current_register_summary.size = vals[0]
-
-						vals.pop(0)
-
-						if vals:
-							# have reset value
-							assert vals[0][:2] == '0x'
-							current_register_summary.reset_value = int(vals[0][2:], 16)
-
-							vals.pop(0)
-
-							if vals:
-								# have desc!
-								current_register_summary.description = vals[0]
-								consume_stack = ['sumreg']
-							else:
-								consume_stack = ['sumreg-d']	
-						else:
-							consume_stack = ['sumreg-rd']
-					elif consume == 'sumreg-rd':
-						# guard
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if len(headings) == 1 and 'Name' in headings[0]:
-							assert False
-							consume_stack = ['sumreg-n', 'sumreg-osr', 'sumreg-d'] + consume_stack
-							continue
-
-						elem.text = re.sub ('\s+', ' ', elem.text)
-						vals = list(map(str.strip, elem.text.strip().split(' ', 1)))
-						# print '\t', vals
-						if vals[0]:
-							# the HDMI fields are blank?
-							assert vals[0][:2] == '0x'
-							current_register_summary.reset_value = int(vals[0][2:], 16)
-
-						vals.pop(0)
-
-						if vals:
-							# have desc
-							current_register_summary.description = vals[0]
-							consume_stack = ['sumreg']
-						else:
-							consume_stack = ['sumreg-d']
-					elif consume == 'sumreg-d':
-						# guard
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if len(headings) == 1 and 'Name' in headings[0]:
-							assert False
-							consume_stack = ['sumreg-n', 'sumreg-osr', 'sumreg-d'] + consume_stack
-							continue
-
-						if elem.find('b') is not None:
-							# print 'UHMMM', elem.find('b').text
-							assert False
-
-						# print '\tadded desc', elem.text.strip()
-						current_register_summary.description = elem.text.strip()
-						sum_desc_col = elem.attrib['left']
-						consume_stack = ['sumreg']
-
-
-				if parsing == 'detail-reg':
-					if elem.attrib['font'] == '5' and consume_stack == []:
-						# detailed register summary header
-						current_register = None
-
-						regname = elem.find('b').text.strip()
-						if regname == 'Bit':
-							# carry over from previous page
-							# should just be BAR for this text element
-							headings = [x.text.strip() for x in elem.findall ('b')]
-							if len(headings) == 1:
-								consume_stack = ['ar', 'd']
-							elif len(headings) == 2:
-								consume_stack = ['r', 'd']
-							elif len(headings) == 3:
-								consume_stack = ['d']
-							else:
-								assert False
-
-							continue
-						elif not regname:
-							continue
-
-						if regname.upper() != regname or ' ' in regname:
-							# not a Real Boy; registers have full caps names
-							continue
-
-						current_register = Register (regname)
-						self.registers.append (current_register)
-						# print 'new header at', regname, 'page', pagenum
-						# if regname == 'CRU_SOFTRST_CON1':
-						# 	sys.exit (1)
-
-						regcount = 1
-						if '~' in regname:
-							fromreg, toreg = regname.split('~')
-							fromregnum = int(fromreg.strip()[-1])
-							toregnum = int(toreg.strip()[-1])
-
-							regcount = toregnum - fromregnum + 1
-							# print "\thave", regcount, "registers"
-
-						consume_stack = ['addr'] * regcount
-						consume_stack += ['desc', 'bar', 'd', 'bits']
-						continue
-					
-					if len(consume_stack):
-						consume = consume_stack.pop(0)
-						# print 'consuming', consume
+				elem.clear()
+			elif elem.tag == 'page':
+				elem.clear()
+
+				# and drop the (already cleared) pages before us from the root
+				while elem.getprevious() is not None:
+					del elem.getparent()[0]
+
+	def extend (self, other):
+		# merge results from another parser (ie. another part), which
+		# should come after ours in the document
+		self.registers += other.registers
+		self.register_summaries += other.register_summaries
+		self.diagnostics.extend (other.diagnostics)
+
+	def parse_peripheral (self, fname, pname, index=None):
+		# only parse the sections of the document that mention pname,
+		# and only keep registers for pname out of those
+		if index is None:
+			index = PageIndex.load (fname)
+
+		sections = index.sections_for (pname)
+		if not sections:
+			self.diagnostics.warning ('no register sections for %s in %s' % (pname, fname))
+
+		p = Parser (self.streaming)
+		p.diagnostics.source = fname
+		for section in sections:
+			p.parse (io.BytesIO (index.page_span (section.first_page, section.last_page)))
+
+		self.registers += [x for x in p.registers if x.name.split('_')[0] == pname]
+		self.register_summaries += [x for x in p.register_summaries if x.name.split('_')[0] == pname]
+		self.diagnostics.extend (p.diagnostics)
+
+		return sections
+
+	def parse (self, filelike):
+		st = ParseState ()
+
+		# we only care about the <text> elements (and the pages, so
+		# stream() can throw them away)
+		iterparse = ET.iterparse(filelike, tag=('text', 'page'))
+
+		elements = 0
+		started = time.time ()
+
+		for event, elem in self.stream (iterparse):
+			if elem.tag != 'text':
+				continue
+
+			elements += 1
+			t = TextElement (elem)
+
+			try:
+				self.handle (st, t)
+			except (TableError, ValueError, IndexError, AttributeError) as e:
+				# don't throw the whole run away over one bad table; note
+				# it and carry on from the next one
+				message = str (e) if isinstance (e, TableError) else '%s: %s' % (type(e).__name__, e)
+				self.diagnostics.error (message, t, st.state)
+				self.skip_table (st)
+
+		elapsed = time.time () - started
+		print('parsed %d elements up to page %d in %.2fs (%d elements/sec); peak RSS %d KiB' % (
+			elements, st.pagenum, elapsed, elements / max (elapsed, 1e-6), peak_rss ()))
+
+	def handle (self, st, t):
+		st.state = None
+
+		if t.font == '0':
+			# ignore header and footer since they're always same
+			return
+
+		if t.font == '1':
+			st.state = 'footer'
+			self.footer (st, t)
+			return
+
+		if t.font == '14':
+			st.state = 'section-heading'
+			if self.section_heading (st, t):
+				return
+
+		if t.font == '5':
+			header_text = t.headings[0]
+			if 'register' in header_text:
+				# print "PI REG GO"
+				st.replace ('heading-n', 'heading-osr', 'heading-d', 'sumreg')
+				return
+
+		if st.parsing == 'summary-reg':
+			consume = st.pop ()
+			st.state = consume
+			# print 'doing', consume
+
+			handler = self.summary_states.get (consume)
+			if handler:
+				handler (self, st, t)
+
+		elif st.parsing == 'detail-reg':
+			if t.font == '5' and not st.stack:
+				# detailed register summary header
+				st.state = 'register'
+				self.detail_register (st, t)
+				return
+
+			consume = st.pop ()
+			# print 'consuming', consume
+
+			if consume == 'bits' and not st.current_register:
+				# nothing to add bits to; at most a description continuation
+				consume = None
+
+			st.state = consume
+			handler = self.detail_states.get (consume)
+			if handler:
+				handler (self, st, t)
+			elif t.left == st.desc_col:
+				st.state = 'bits-desc'
+				self.detail_bits_desc (st, t)
+
+	def skip_table (self, st):
+		# throw away whatever we were half way through, and wait for the
+		# next table (or the next row, for summaries)
+		if st.parsing == 'summary-reg' and st.state in ('sumreg', 'sumreg-osrd', 'sumreg-range', 'sumreg-srd', 'sumreg-rd', 'sumreg-d', 'sumreg-skip'):
+			# just this row; drop the summary if it was only half read
+			if st.state not in ('sumreg', 'sumreg-d', 'sumreg-skip') and self.register_summaries and self.register_summaries[-1] is st.current_register_summary:
+				self.register_summaries.pop ()
+			st.summary_range = None
+			st.replace ('sumreg-skip')
+		elif st.parsing == 'detail-reg':
+			if st.current_register is not None and self.registers and self.registers[-1] is st.current_register:
+				self.registers.pop ()
+			st.current_register = None
+			st.current_bits = None
+			st.desc_col = None
+			st.partial_access_policy = ''
+			st.replace ()
+		else:
+			st.replace ()
+
+	def footer (self, st, t):
+		# grab pagenum
+		footer = t.elem.find ('i').text
+		m = COPYRIGHT_RE.match (footer)
+		if m:
+			st.pagenum = int (m.group (1))
+		else:
+			if footer.startswith ('Notes:'):
+				# hit the notes at the bottom of table
+				# so table must be done; clear it to stop
+				st.replace ()
+
+	def section_heading (self, st, t):
+		# returns True if we're done with this element
+		header_text = t.headings[0]
+		# print 'ht', header_text
+		if 'Detail Register Description' in header_text:
+			st.replace ()
+			st.parsing = 'detail-reg'
+		elif 'Register Summary' in header_text or 'Registers Summary' in header_text:
+			st.replace ('heading-n', 'heading-osr', 'heading-d', 'sumreg')
+			st.parsing = 'summary-reg'
+			return True
+		else:
+			# try without heading bit
+			header_text = t.bold[0].tail
+			if header_text:
+				# print 'ht-nobold', header_text
+				if 'Detail Register Description' in header_text:
+					st.replace ()
+					st.parsing = 'detail-reg'
+				elif 'Register Summary' in header_text or 'Registers Summary' in header_text:
+					st.replace ('heading-n', 'heading-osr', 'heading-d', 'sumreg')
+					st.parsing = 'summary-reg'
+					return True
+				else:
+					st.parsing = None
+			else:
+				# print '\tno non-bold text either'
+				st.parsing = None
+				return True
+
+		return False
+
+	# register summary table states
+
+	def summary_heading_n (self, st, t):
+		if t.font == '3':
+			# print '\tskipping size 3 font...'
+			# print '\t', elem.text
+			if not t.bold:
+				st.push ('heading-n')
+				return
+			else:
+				raise TableError ('bold text before summary table heading')
+
+		if t.font != '5':
+			self.diagnostics.warning ("skipping register summary table that doesn't match our format (font was %s)" % t.font, t, st.state)
+			st.replace ()
+			return
+
+		# assert elem.attrib['font'] == '5'
+		if t.headings[0] != 'Name':
+			self.diagnostics.warning ('skipping register summary table not in right format', t, st.state)
+			st.replace ()
+			return
+
+		expect (len(t.bold) == 1, 'unexpected summary table heading layout')
+
+	def summary_heading_osr (self, st, t):
+		if len(t.bold) == 1:
+			headings = WHITESPACE_RE.sub (' ', t.bold[0].text).strip().split(' ')
+			if len(headings) == 2:
+				st.push ('heading-r')
+			elif len(headings) == 1:
+				st.push ('heading-sr')
+			else:
+				expect (len(headings) == 3, 'unexpected summary table heading layout')
+
+		elif len(t.bold) == 2:
+			st.push ('heading-r')
+		else:
+			expect (len(t.bold) == 3, 'unexpected summary table heading layout')
+
+	def summary_heading_sr (self, st, t):
+		if len(t.bold) == 1:
+			headings = list(map (str.strip, t.bold[0].text.split(' ', 1)))
+			expect (headings == ['Size', 'Reset Value'], 'unexpected summary table heading layout')
+		else:
+			expect (len(t.bold) == 2, 'unexpected summary table heading layout')
+			expect (t.headings[0] == 'Size', 'unexpected summary table heading layout')
+
+	def summary_heading_r (self, st, t):
+		expect (t.headings[0] == 'Reset', 'unexpected summary table heading layout')
+		expect (len(t.bold) == 1, 'unexpected summary table heading layout')
+
+	def summary_heading_d (self, st, t):
+		if t.headings[0] == 'Value':
+			# eugh, from previous text node; do us again
+			st.push ('heading-d')
+		else:
+			expect (t.headings[0] == 'Description', 'unexpected summary table heading layout')
+			expect (len(t.bold) == 1, 'unexpected summary table heading layout')
+
+	def summary_register (self, st, t):
+		# guard
+		headings = t.headings
+		if len(headings) == 1 and 'Name' in headings[0]:
+			st.replace ('heading-osr', 'heading-d', 'sumreg')
+			return
+
+		elem = t.elem
+		if st.sum_desc_col and t.left == st.sum_desc_col:
+			# print '\tadded to description:', elem.text.strip()
+			st.current_register_summary.description += ' ' + elem.text.strip()
+			st.replace ('sumreg')
+			return
+
+		if not elem.text:
+			# no more registers
+			st.replace ()
+			return
+
+		vals = WHITESPACE_RE.sub (' ', elem.text.strip()).split(' ', 4)
+
+		regname_arr = []
+		this_offset = None
+		this_size = None
+		this_reset = None
+		this_desc = None
+
+		# print '\t', vals
+
+		for v in vals:
+			if v.startswith ('0x') and this_offset is None:
+				this_offset = int(v, 16)
+			else:
+				if this_offset is not None:
+					# do this only after we have offset
+					if this_size is None:
+						this_size = v
+					elif this_reset is None:
+						this_reset = v
 					else:
-						consume = None
-
-					if consume == 'addr':
-						if elem.text is None or not elem.text.strip() or 'Operational Base' not in elem.text:
-							print('elem text is', elem.text)
-							print('on page', pagenum)
-							print()
-							print('WARNING: assuming what follows is not register set')
-							consume_stack = []
-							current_register = None
-							parsing = None
-							continue
-
-						m = re.search (r'Operational Base \+ offset \(0x([A-Fa-f0-9]+)\)', elem.text)
-						if not m:
-							m = re.search (r'Operational Base\+0x([A-Fa-f0-9]+)', elem.text)
-							if not m:
-								# maybe range
-								m = re.search (r'Operational Base \+ offset \(0x([A-Fa-f0-9]+)~0x([A-Fa-f0-9]+)\)', elem.text)
-								if not m:
-									print("elem text is", elem.text)
-									assert m
-
-								# FIXME: currently assumes access via word (I haven't seen an exception yet but might be wrong)
-								for i in range (int(m.group(1), 16), int(m.group(2), 16) + 4, 4):
-									# print hex(i)
-									current_register.address_offsets.append (i)
-
-								continue
-
-						current_register.address_offsets.append (int(m.group(1), 16))
-					elif consume == 'desc':
-						assert current_register.description is None
-						current_register.description = elem.text.strip()
-					elif consume == 'bar':
-						# skip bit attr reset value description fields
-						headings = [x.text.strip() for x in elem.findall ('b')]
-
-						if headings == ['Bit', 'Attr', 'Reset Value']:
-							pass
-						elif headings == ['Bit']:
-							consume_stack = ['ar'] + consume_stack
-						elif headings == ['Bit', 'Attr']:
-							consume_stack = ['r'] + consume_stack
-						else:
-							# wtf
-							if headings:
-								maybe_headings = list(map(str.strip, re.sub('\s+', ' ', headings[0]).split(' ', 2)))
-								if maybe_headings == ['Bit', 'Attr', 'Reset Value']:
-									pass
-								elif maybe_headings == ['Bit']:
-									consume_stack = ['ar'] + consume_stack
-								elif maybe_headings == ['Bit', 'Attr']:
-									consume_stack = ['r'] + consume_stack
-								else:
-									print('uh oh', headings)
-									print(elem.text)
-									assert False
-							else:
-								# do again, wasn't a heading, but a description continuation
-								current_register.description += '\n' + elem.text
-								consume_stack = ['bar'] + consume_stack
-					elif consume == 'ar':
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if headings == ['Attr', 'Reset Value']:
-							pass
-						elif headings == ['Reset Value']:
-							consume_stack = ['r'] + consume_stack
-						else:
-							print('uh oh', headings)
-							assert False
-					elif consume == 'r':
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if headings == ['Reset Value']:
-							pass
-						else:
-							print('uh oh', headings)
-							assert False
-					elif consume == 'd':
-						assert elem.find('b').text.strip() == 'Description'
-					elif consume == 'bits' and current_register:
-						# guard
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if len(headings) == 1 and 'Bit' in headings[0]:
-							consume_stack = ['ar', 'd', 'bits']
-							continue
-						elif len(headings) == 2 and 'Bit' in headings[0]:
-							consume_stack = ['r', 'd', 'bits']
-							continue
-						elif len(headings) == 3 and 'Bit' in headings[0]:
-							consume_stack = ['d', 'bits']
-							continue
-
-						if elem.attrib['font'] != '3':
-							continue
-
-						if elem.attrib['left'] == desc_col:
-							# actually just an extension of description
-							# print '\tcontinued desc', elem.text
-							current_bits.description += '\n' + elem.text.strip()
-							consume_stack = ['bits']
-						else:
-							elem.text = re.sub ('\s+', ' ', elem.text)
-							v = elem.text.strip().split(' ')
-
-							if not elem.text.strip():
-								continue
-
-							current_bits = BitAccess()
-							partial_access_policy = ''
-							desc_col = None
-							bitrange = v.pop (0).strip()
-							# try:
-							if True:
-								if ':' in bitrange:
-									frombit, tobit = bitrange.split(':')
-									current_bits.bit_range = (int(frombit), int(tobit))
-								else:
-									current_bits.bit_range = (int(bitrange), int(bitrange))
-							# except ValueError:
-							# 	continue
-
-							# and add it ;)
-							# print 'new bitaccess on', elem.text
-							current_register.bits.append (current_bits)
-
-							if v:
-								# also have attr
-								attr = v.pop(0).strip()
-								if attr == 'R/W':
-									attr = 'RW'
-								elif attr == 'RU':
-									attr = 'RO'
-									current_bits.volatile = True
-								elif attr == 'RC':
-									attr = 'RC'
-
-								# print attr
-								assert attr in ['RW', 'RO', 'WO', 'W1C', 'RC']
-								current_bits.access_policy = attr
-
-								if v:
-									# also have resetval
-									resetval = v.pop(0).strip()
-									assert resetval[:2] == '0x'
-									current_bits.reset_value = int(resetval[2:], 16)
-
-									if v:
-										# ALSO! have description
-										# unlikely... haha
-										current_bits.description = ' '.join (v).strip()
-										desc_col = None # but we don't know desccol
-										consume_stack = ['bits']
-									else:
-										consume_stack = ['bits-desc']
-								else:
-									consume_stack = ['bits-rd']
-							else:
-								# need attr, resetval, desc
-								# print '\tneed ard'
-								consume_stack = ['bits-ard']
-					elif consume == 'bits-ard':
-						# guard
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if len(headings) == 1 and 'Bit' in headings[0]:
-							consume_stack = ['ar', 'd', 'bits']
-							continue
-						elif len(headings) == 2 and 'Bit' in headings[0]:
-							consume_stack = ['r', 'd', 'bits']
-							continue
-						elif len(headings) == 3 and 'Bit' in headings[0]:
-							consume_stack = ['d', 'bits']
-							continue
-
-						elem.text = re.sub ('\s+', ' ', elem.text)
-						v = elem.text.strip().split(' ')
-						attr = partial_access_policy + v.pop(0).strip()
-
-						if attr == 'R/W':
-							attr = 'RW'
-						elif attr == 'W1':
-							# need to know what next bit is
-							partial_access_policy = 'W1'
-							if v:
-								attr = partial_access_policy + v.pop(0).strip()
-							else:
-								consume_stack = ['bits-ard']
-								continue
-
-						# print attr
-						assert attr in ['RW', 'RO', 'WO', 'W1C', 'RC']
-						current_bits.access_policy = attr
-
-						if v:
-							# also have resetval
-							resetval = v.pop(0).strip()
-							assert resetval[:2] == '0x'
-							current_bits.reset_value = int(resetval[2:], 16)
-
-							if v:
-								# ALSO! have description
-								# unlikely... haha
-								current_bits.description = ' '.join (v).strip()
-								desc_col = None # but we don't know desccol
-								consume_stack = ['bits']
-							else:
-								consume_stack = ['bits-desc']
-						else:
-							# print '\tneed rd'
-							consume_stack = ['bits-rd']
-					elif consume == 'bits-rd':
-						# guard
-						headings = [x.text.strip() for x in elem.findall ('b')]
-						if len(headings) == 1 and 'Bit' in headings[0]:
-							consume_stack = ['ar', 'd', 'bits']
-							continue
-						elif len(headings) == 2 and 'Bit' in headings[0]:
-							consume_stack = ['r', 'd', 'bits']
-							continue
-						elif len(headings) == 3 and 'Bit' in headings[0]:
-							consume_stack = ['d', 'bits']
-							continue
-
-						# also have resetval
-						elem.text = re.sub ('\s+', ' ', elem.text)
-						v = elem.text.strip().split(' ')
-						resetval = v.pop(0).strip()
-
-						if resetval == 'SC':
-							assert current_bits.access_policy == 'RW'
-							current_bits.access_policy = 'WC'
-
-							# sigh; do it again
-							if v:
-								resetval = v.pop(0).strip()
-							else:
-								consume_stack = ['bits-rd']
-								continue
-
-
-						assert resetval[:2] == '0x'
-						current_bits.reset_value = int(resetval[2:], 16)
-
-						if v:
-							# ALSO! have description
-							# unlikely... haha
-							current_bits.description = ' '.join (v).strip()
-							desc_col = None # but we don't know desccol
-							consume_stack = ['bits']
-						else:
-							consume_stack = ['bits-desc']
-					elif consume == 'bits-desc' or elem.attrib['left'] == desc_col:
-						desc_col = elem.attrib['left']
-						if current_bits.description:
-							current_bits.description += '\n' + elem.text.strip()
-						else:
-							current_bits.description = elem.text.strip()
-
-						# print '\thad desc', elem.text
-						consume_stack = ['bits']
+						this_desc = v
+				else:
+					# still name
+					regname_arr.append (v)
+
+		# no name found, screw it
+		if not regname_arr[0]:
+			return
+
+		regname_str = ' '.join (regname_arr)
+
+		if not SUMMARY_REGNAME_RE.match (regname_str):
+			st.current_register_summary.description += regname_str
+			st.replace ('sumreg')
+			return
+		elif ' ' in regname_str:
+			# for now, disallow spaces in register
+			self.diagnostics.warning ('space in register name, skipping', t, st.state)
+			#current_register_summary.description += regname_str
+			st.replace ('sumreg')
+			return
+
+		r = RegisterSummary (regname_str)
+		st.current_register_summary = r
+		st.sum_name_col = t.left
+
+		if this_offset is not None:
+			r.offset_range = (this_offset, this_offset)
+
+		if this_size:
+			expect (this_size in REGISTER_SIZES, 'unknown register size')
+			r.size = this_size
+
+		if this_reset:
+			# print this_reset
+			expect (this_reset[:2] == '0x', 'expected a hex value')
+			r.reset_value = int(this_reset[2:], 16)
+
+		if this_desc:
+			r.description = this_desc.strip()
+
+		# print '\tnew register', regname_str
+
+		st.sum_desc_col = None
+		self.register_summaries.append (r)
+
+		if this_offset is None:
+			st.replace ('sumreg-osrd')
+		elif this_size is None:
+			st.replace ('sumreg-srd')
+		elif this_reset is None:
+			st.replace ('sumreg-rd')
+		elif this_desc is None:
+			st.replace ('sumreg-d')
+		else:
+			st.replace ('sumreg')
+
+	def summary_register_osrd (self, st, t):
+		# guard
+		headings = t.headings
+		if len(headings) == 1 and 'Name' in headings[0]:
+			raise TableError ('summary table heading in the middle of a register row')
+
+		elem = t.elem
+		if t.left == st.sum_name_col:
+			# name clipped; go again
+			# print '\tname clipped, adding', elem.text.strip()
+			st.current_register_summary.name += elem.text.strip()
+			st.replace ('sumreg-osrd')
+			return
+
+		text = WHITESPACE_RE.sub (' ', elem.text)
+		vals = list(map(str.strip, text.strip().split(' ', 3)))
+
+		# print '\t', vals
+		expect (vals[0][:2] == '0x', 'expected a hex value')
+		if vals[0].endswith ('~'):
+			# print '\trange'
+			st.summary_range = vals[0][2:-1]
+			expect (len(vals) == 1, 'expected only the start of an offset range') # rely 100% on next step to do this
+			st.replace ('sumreg-range', 'sumreg-srd')
+			return
+		else:
+			st.summary_range = None
+			st.current_register_summary.offset_range = (int(vals[0][2:], 16), int(vals[0][2:], 16))
+
+		if len(vals) == 1:
+			st.replace ('sumreg-srd')
+		else:
+			vals.pop(0)
+
+			expect (vals[0] in REGISTER_SIZES, 'unknown register size')
+			st.current_register_summary.size = vals[0]
+
+			vals.pop(0)
+
+			if vals:
+				# had reset value
+				expect (vals[0].startswith ('0x'), 'expected a hex value')
+				st.current_register_summary.reset_value = int(vals[0][2:], 16)
+				vals.pop (0)
+
+				if vals:
+					# also had desc!
+					st.current_register_summary.description = vals[0]
+					st.replace ('sumreg')
+				else:
+					st.replace ('sumreg-d')
+			else:
+				st.replace ('sumreg-rd')
+
+	def summary_register_range (self, st, t):
+		# sometimes split over 2 lines; called by sumreg-osrd
+		text = WHITESPACE_RE.sub (' ', t.elem.text)
+		vals = list(map(str.strip, text.strip().split(' ')))
+		expect (len(vals) == 1, 'expected only the end of an offset range')
+
+		expect (vals[0][:2] == '0x', 'expected a hex value')
+		st.current_register_summary.offset_range = (int(st.summary_range, 16), int(vals[0][2:], 16))
+
+	def summary_register_srd (self, st, t):
+		# guard
+		headings = t.headings
+		if len(headings) == 1 and 'Name' in headings[0]:
+			raise TableError ('summary table heading in the middle of a register row')
+
+		text = WHITESPACE_RE.sub (' ', t.elem.text)
+		vals = list(map(str.strip, text.strip().split(' ', 2)))
+		# print '\tsrd', vals
+
+		if vals[0].startswith ('~0x'):
+			# range from last field
+			st.current_register_summary.offset_range = (
+				st.current_register_summary.offset_range[0],
+				int (vals[0][3:], 16))
+
+			# try again
+			st.push ('sumreg-srd')
+			return
+
+		expect (vals[0] in REGISTER_SIZES, 'unknown register size')
+		st.current_register_summary.size = vals[0]
+
+		vals.pop(0)
+
+		if vals:
+			# have reset value
+			expect (vals[0][:2] == '0x', 'expected a hex value')
+			st.current_register_summary.reset_value = int(vals[0][2:], 16)
+
+			vals.pop(0)
+
+			if vals:
+				# have desc!
+				st.current_register_summary.description = vals[0]
+				st.replace ('sumreg')
+			else:
+				st.replace ('sumreg-d')
+		else:
+			st.replace ('sumreg-rd')
+
+	def summary_register_rd (self, st, t):
+		# guard
+		headings = t.headings
+		if len(headings) == 1 and 'Name' in headings[0]:
+			raise TableError ('summary table heading in the middle of a register row')
+
+		text = WHITESPACE_RE.sub (' ', t.elem.text)
+		vals = list(map(str.strip, text.strip().split(' ', 1)))
+		# print '\t', vals
+		if vals[0]:
+			# the HDMI fields are blank?
+			expect (vals[0][:2] == '0x', 'expected a hex value')
+			st.current_register_summary.reset_value = int(vals[0][2:], 16)
+
+		vals.pop(0)
+
+		if vals:
+			# have desc
+			st.current_register_summary.description = vals[0]
+			st.replace ('sumreg')
+		else:
+			st.replace ('sumreg-d')
+
+	def summary_register_d (self, st, t):
+		if t.left == st.sum_name_col:
+			# actually the next register
+			self.summary_register (st, t)
+			return
+
+		# guard
+		headings = t.headings
+		if len(headings) == 1 and 'Name' in headings[0]:
+			raise TableError ('summary table heading in the middle of a register row')
+
+		if t.bold:
+			# print 'UHMMM', elem.find('b').text
+			raise TableError ('bold text in register description')
+
+		# print '\tadded desc', elem.text.strip()
+		st.current_register_summary.description = t.elem.text.strip()
+		st.sum_desc_col = t.left
+		st.replace ('sumreg')
+
+	def summary_register_skip (self, st, t):
+		# after a bad row; ignore the rest of it until the next one starts
+		if t.left == st.sum_name_col:
+			self.summary_register (st, t)
+		else:
+			st.replace ('sumreg-skip')
+
+	summary_states = {
+		'heading-n':	summary_heading_n,
+		'heading-osr':	summary_heading_osr,
+		'heading-sr':	summary_heading_sr,
+		'heading-r':	summary_heading_r,
+		'heading-d':	summary_heading_d,
+		'sumreg':	summary_register,
+		'sumreg-osrd':	summary_register_osrd,
+		'sumreg-range':	summary_register_range,
+		'sumreg-srd':	summary_register_srd,
+		'sumreg-rd':	summary_register_rd,
+		'sumreg-d':	summary_register_d,
+		'sumreg-skip':	summary_register_skip,
+	}
+
+	# detail register description states
+
+	def detail_register (self, st, t):
+		st.current_register = None
+
+		regname = t.headings[0]
+		if regname == 'Bit':
+			# carry over from previous page
+			# should just be BAR for this text element
+			if len(t.headings) == 1:
+				st.replace ('ar', 'd')
+			elif len(t.headings) == 2:
+				st.replace ('r', 'd')
+			elif len(t.headings) == 3:
+				st.replace ('d')
+			else:
+				raise TableError ('unexpected detail table heading layout')
+
+			return
+		elif not regname:
+			return
+
+		if regname.upper() != regname or ' ' in regname:
+			# not a Real Boy; registers have full caps names
+			return
+
+		st.current_register = Register (regname)
+		st.current_register.page = t.page
+		self.registers.append (st.current_register)
+		# print 'new header at', regname, 'page', pagenum
+
+		regcount = 1
+		if '~' in regname:
+			fromreg, toreg = regname.split('~')
+			fromregnum = int(fromreg.strip()[-1])
+			toregnum = int(toreg.strip()[-1])
+
+			regcount = toregnum - fromregnum + 1
+			# print "\thave", regcount, "registers"
+
+		st.replace (*(['addr'] * regcount + ['desc', 'bar', 'd', 'bits']))
+
+	def detail_addr (self, st, t):
+		elem = t.elem
+		if elem.text is None or not elem.text.strip() or 'Operational Base' not in elem.text:
+			self.diagnostics.warning ('no register address; assuming what follows is not register set', t, st.state)
+			st.replace ()
+			st.current_register = None
+			st.parsing = None
+			return
+
+		m = OFFSET_RE.search (elem.text)
+		if not m:
+			m = OFFSET_SHORT_RE.search (elem.text)
+			if not m:
+				# maybe range
+				m = OFFSET_RANGE_RE.search (elem.text)
+				if not m:
+					raise TableError ('no offset in register address')
+
+				# FIXME: currently assumes access via word (I haven't seen an exception yet but might be wrong)
+				for i in range (int(m.group(1), 16), int(m.group(2), 16) + 4, 4):
+					# print hex(i)
+					st.current_register.address_offsets.append (i)
+
+				return
+
+		st.current_register.address_offsets.append (int(m.group(1), 16))
+
+	def detail_desc (self, st, t):
+		expect (st.current_register.description is None, 'register already has a description')
+		st.current_register.description = t.elem.text.strip()
+
+	def detail_bar (self, st, t):
+		# skip bit attr reset value description fields
+		headings = t.headings
+
+		if headings == ['Bit', 'Attr', 'Reset Value']:
+			pass
+		elif headings == ['Bit']:
+			st.push ('ar')
+		elif headings == ['Bit', 'Attr']:
+			st.push ('r')
+		else:
+			# wtf
+			if headings:
+				maybe_headings = list(map(str.strip, WHITESPACE_RE.sub (' ', headings[0]).split(' ', 2)))
+				if maybe_headings == ['Bit', 'Attr', 'Reset Value']:
+					pass
+				elif maybe_headings == ['Bit']:
+					st.push ('ar')
+				elif maybe_headings == ['Bit', 'Attr']:
+					st.push ('r')
+				else:
+					raise TableError ('unexpected detail table heading %r' % headings)
+			else:
+				# do again, wasn't a heading, but a description continuation
+				st.current_register.description += '\n' + t.elem.text
+				st.push ('bar')
+
+	def detail_ar (self, st, t):
+		headings = t.headings
+		if headings == ['Attr', 'Reset Value']:
+			pass
+		elif headings == ['Reset Value']:
+			st.push ('r')
+		else:
+			raise TableError ('unexpected detail table heading %r' % headings)
+
+	def detail_r (self, st, t):
+		headings = t.headings
+		if headings == ['Reset Value']:
+			pass
+		else:
+			raise TableError ('unexpected detail table heading %r' % headings)
+
+	def detail_d (self, st, t):
+		expect (t.headings[0] == 'Description', 'unexpected detail table heading layout')
+
+	def bits_heading (self, st, t):
+		# guard against the table heading being repeated (ie. new page);
+		# returns True if it was
+		headings = t.headings
+		if len(headings) == 1 and 'Bit' in headings[0]:
+			st.replace ('ar', 'd', 'bits')
+			return True
+		elif len(headings) == 2 and 'Bit' in headings[0]:
+			st.replace ('r', 'd', 'bits')
+			return True
+		elif len(headings) == 3 and 'Bit' in headings[0]:
+			st.replace ('d', 'bits')
+			return True
+
+		return False
+
+	def detail_bits (self, st, t):
+		if self.bits_heading (st, t):
+			return
+
+		if t.font != '3':
+			return
+
+		elem = t.elem
+		if t.left == st.desc_col:
+			# actually just an extension of description
+			# print '\tcontinued desc', elem.text
+			st.current_bits.description += '\n' + elem.text.strip()
+			st.replace ('bits')
+			return
+
+		text = WHITESPACE_RE.sub (' ', elem.text).strip()
+		v = text.split(' ')
+
+		if not text:
+			return
+
+		current_bits = BitAccess()
+		st.current_bits = current_bits
+		st.partial_access_policy = ''
+		st.desc_col = None
+		bitrange = v.pop (0).strip()
+
+		if ':' in bitrange:
+			frombit, tobit = bitrange.split(':')
+			current_bits.bit_range = (int(frombit), int(tobit))
+		else:
+			current_bits.bit_range = (int(bitrange), int(bitrange))
+
+		# and add it ;)
+		# print 'new bitaccess on', elem.text
+		st.current_register.bits.append (current_bits)
+
+		if v:
+			# also have attr
+			attr = v.pop(0).strip()
+			if attr == 'R/W':
+				attr = 'RW'
+			elif attr == 'RU':
+				attr = 'RO'
+				current_bits.volatile = True
+			elif attr == 'RC':
+				attr = 'RC'
+
+			# print attr
+			expect (attr in ACCESS_POLICIES, 'unknown access policy %s' % attr)
+			current_bits.access_policy = attr
+
+			if v:
+				# also have resetval
+				resetval = v.pop(0).strip()
+				expect (resetval[:2] == '0x', 'expected a hex value')
+				current_bits.reset_value = int(resetval[2:], 16)
+
+				if v:
+					# ALSO! have description
+					# unlikely... haha
+					current_bits.description = ' '.join (v).strip()
+					st.desc_col = None # but we don't know desccol
+					st.replace ('bits')
+				else:
+					st.replace ('bits-desc')
+			else:
+				st.replace ('bits-rd')
+		else:
+			# need attr, resetval, desc
+			# print '\tneed ard'
+			st.replace ('bits-ard')
+
+	def detail_bits_ard (self, st, t):
+		if self.bits_heading (st, t):
+			return
+
+		current_bits = st.current_bits
+		v = WHITESPACE_RE.sub (' ', t.elem.text).strip().split(' ')
+		attr = st.partial_access_policy + v.pop(0).strip()
+
+		if attr == 'R/W':
+			attr = 'RW'
+		elif attr == 'W1':
+			# need to know what next bit is
+			st.partial_access_policy = 'W1'
+			if v:
+				attr = st.partial_access_policy + v.pop(0).strip()
+			else:
+				st.replace ('bits-ard')
+				return
+
+		# print attr
+		expect (attr in ACCESS_POLICIES, 'unknown access policy %s' % attr)
+		current_bits.access_policy = attr
+
+		if v:
+			# also have resetval
+			resetval = v.pop(0).strip()
+			expect (resetval[:2] == '0x', 'expected a hex value')
+			current_bits.reset_value = int(resetval[2:], 16)
+
+			if v:
+				# ALSO! have description
+				# unlikely... haha
+				current_bits.description = ' '.join (v).strip()
+				st.desc_col = None # but we don't know desccol
+				st.replace ('bits')
+			else:
+				st.replace ('bits-desc')
+		else:
+			# print '\tneed rd'
+			st.replace ('bits-rd')
+
+	def detail_bits_rd (self, st, t):
+		if self.bits_heading (st, t):
+			return
+
+		# also have resetval
+		current_bits = st.current_bits
+		v = WHITESPACE_RE.sub (' ', t.elem.text).strip().split(' ')
+		resetval = v.pop(0).strip()
+
+		if resetval == 'SC':
+			expect (current_bits.access_policy == 'RW', 'SC reset value on a field that isn\'t RW')
+			current_bits.access_policy = 'WC'
+
+			# sigh; do it again
+			if v:
+				resetval = v.pop(0).strip()
+			else:
+				st.replace ('bits-rd')
+				return
+
+		expect (resetval[:2] == '0x', 'expected a hex value')
+		current_bits.reset_value = int(resetval[2:], 16)
+
+		if v:
+			# ALSO! have description
+			# unlikely... haha
+			current_bits.description = ' '.join (v).strip()
+			st.desc_col = None # but we don't know desccol
+			st.replace ('bits')
+		else:
+			st.replace ('bits-desc')
+
+	def detail_bits_desc (self, st, t):
+		st.desc_col = t.left
+		if st.current_bits.description:
+			st.current_bits.description += '\n' + t.elem.text.strip()
+		else:
+			st.current_bits.description = t.elem.text.strip()
+
+		# print '\thad desc', elem.text
+		st.replace ('bits')
+
+	detail_states = {
+		'addr':		detail_addr,
+		'desc':		detail_desc,
+		'bar':		detail_bar,
+		'ar':		detail_ar,
+		'r':		detail_r,
+		'd':		detail_d,
+		'bits':		detail_bits,
+		'bits-ard':	detail_bits_ard,
+		'bits-rd':	detail_bits_rd,
+		'bits-desc':	detail_bits_desc,
+	}
 
 	def check (self):
+		# returns False if anything's too broken to export
+		errors = len (self.diagnostics.errors ())
+
 		# now we have summaries, get the width for each register
 		widths = {}
 		size_to_bits = {
@@ -767,10 +1313,8 @@ class Parser (object):
 			try:
 				widths[regsum.name] = size_to_bits[regsum.size]
 			except KeyError:
-				print('no size for', regsum.name, 'with', regsum.size)
-
 				# assume 32-bit?
-				raise
+				self.diagnostics.error ('no size for %s with %s' % (regsum.name, regsum.size), state='check')
 
 		# sanity check the register bit accesses
 		for reg in self.registers:
@@ -786,7 +1330,7 @@ class Parser (object):
 				reg.name = 'EFUSE_STROBE_FINISH_CTRL'
 
 			if not reg.bits:
-				print("WARNING: no bits for", reg)
+				self.diagnostics.warning ('no bits for %s' % reg, state='check', page=reg.page)
 				continue
 
 			if reg.name == 'UART_MCR':
@@ -803,19 +1347,47 @@ modem or data set that the UART is ready to exchange data."""
 
 				reg.bits.insert (-1, b)
 
-			last_bit = widths[reg.name]
-			for ba in reg.bits:
-				# print '\t', ba.description.split('\n')[0]
+			if reg.name not in widths:
+				self.diagnostics.error ('no register summary (so no width) for %s' % reg, state='check', page=reg.page)
+				continue
+
+			# every bit should be in exactly one field (reserved ones too)
+			coverage = Coverage (reg.bits, widths[reg.name])
+
+			for ba in coverage.backwards:
+				self.diagnostics.error ('%s: %r has a backwards bit range' % (reg, ba), state='check', page=reg.page)
+
+			if coverage.overlap:
+				self.diagnostics.error ('%s: bits %s are in more than one field' % (reg, mask_ranges (coverage.overlap)), state='check', page=reg.page)
+
+			if coverage.outside ():
+				self.diagnostics.error ('%s: bits %s are past its %d bits' % (reg, mask_ranges (coverage.outside ()), coverage.width), state='check', page=reg.page)
+
+			if coverage.gaps ():
+				self.diagnostics.error ('%s: bits %s aren\'t in any field' % (reg, mask_ranges (coverage.gaps ())), state='check', page=reg.page)
+
+		return len (self.diagnostics.errors ()) == errors
+
+def parse_file (fname, streaming=True):
+	# entry point for worker processes; each part gets a parser of its own
+	p = Parser (streaming)
+	p.diagnostics.source = fname
+	with open (fname, 'rb') as f:
+		p.parse (f)
+
+	return p
 
-				if ba.bit_range[0] != (last_bit - 1):
-					print(ba, 'started in wrong place; expected', (last_bit - 1))
-					assert False
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		sys.stderr.write('usage: %s <part.xml> <peripheral>\n' % sys.argv[0])
+		sys.exit(1)
 
-				last_bit = ba.bit_range[1]
-				assert ba.bit_range[0] >= ba.bit_range[1]
+	p = Parser ()
+	for section in p.parse_peripheral (sys.argv[1], sys.argv[2].upper()):
+		print('parsed', section)
 
-			if last_bit != 0:
-				print('um, ended on bit', last_bit)
-				assert last_bit == 0
+	p.check ()
+	for reg in p.registers:
+		print(reg, reg.address_offsets, reg.bits)
 
-		return True
\ No newline at end of file
+	print(p.diagnostics.summary ())
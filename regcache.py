@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import pickle
+
+# on-disk cache of parsed objects, keyed by a hash of everything they were
+# built from (source data *and* the code that parsed it)
+class Cache (object):
+	def __init__ (self, path='.cache', enabled=True):
+		self.path = path
+		self.enabled = enabled
+
+		# (size, mtime) -> content hash, so we don't rehash the big TRM
+		# dumps every run when they haven't been touched
+		self.digests = {}
+		self.digests_fname = os.path.join (path, 'digests.json')
+
+		if enabled and os.path.exists (self.digests_fname):
+			with open (self.digests_fname, 'r') as f:
+				self.digests = json.load (f)
+
+	def file_digest (self, fname):
+		st = os.stat (fname)
+		stamp = [st.st_size, st.st_mtime_ns]
+
+		path = os.path.abspath (fname)
+		if path in self.digests and self.digests[path][0] == stamp:
+			return self.digests[path][1]
+
+		h = hashlib.sha1 ()
+		with open (fname, 'rb') as f:
+			for chunk in iter (lambda: f.read (1 << 20), b''):
+				h.update (chunk)
+
+		self.digests[path] = [stamp, h.hexdigest ()]
+		self.save_digests ()
+
+		return h.hexdigest ()
+
+	def object_digest (self, obj):
+		# by value, not by pickle, which depends on which objects happen
+		# to be shared
+		data = json.dumps (obj, sort_keys=True, default=lambda x: x.__dict__)
+		return hashlib.sha1 (data.encode ('utf-8')).hexdigest ()
+
+	def save_digests (self):
+		if not self.enabled:
+			return
+
+		if not os.path.exists (self.path):
+			os.makedirs (self.path)
+
+		with open (self.digests_fname, 'w') as f:
+			json.dump (self.digests, f)
+
+	def key (self, kind, sources, extra=None):
+		# extra: digest of anything else the object was built from that
+		# isn't a file (ie. other cached objects)
+		h = hashlib.sha1 (kind.encode ('utf-8'))
+		for fname in sources:
+			h.update (self.file_digest (fname).encode ('utf-8'))
+
+		if extra is not None:
+			h.update (extra.encode ('utf-8'))
+
+		return '%s-%s' % (kind, h.hexdigest ())
+
+	def get (self, kind, sources, extra=None):
+		if not self.enabled:
+			return None
+
+		fname = os.path.join (self.path, self.key (kind, sources, extra) + '.pickle')
+		if not os.path.exists (fname):
+			return None
+
+		with open (fname, 'rb') as f:
+			return pickle.load (f)
+
+	def put (self, kind, sources, obj, extra=None):
+		if not self.enabled:
+			return
+
+		if not os.path.exists (self.path):
+			os.makedirs (self.path)
+
+		fname = os.path.join (self.path, self.key (kind, sources, extra) + '.pickle')
+		with open (fname + '.tmp', 'wb') as f:
+			pickle.dump (obj, f, pickle.HIGHEST_PROTOCOL)
+
+		os.rename (fname + '.tmp', fname)
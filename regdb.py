@@ -0,0 +1,366 @@
+import collections
+import mmap
+import os
+import re
+import struct
+import sys
+
+import lxml.etree as ET
+
+# compact register database, built from an SVD, so tools can look up
+# "address of CRU.CRU_CLKSEL_CON0" or "bits of CRU.CRU_CLKSEL_CON0.CLK_PLL_SEL"
+# straight out of a memory mapped file, without parsing the whole SVD
+#
+# layout (little endian, sections 8-byte aligned):
+#	header		magic, version, then (offset, count) for each section
+#	strings		count + 1 u32 offsets into the blob that follows them
+#	peripherals	name, derived from, base address, first register, registers
+#	registers	name, offset, size, dim, dim increment, dim index, reset
+#			value, first field, fields
+#	fields		name, register, msb, lsb, access
+#	index		open addressed hash table of lowercased names, either
+#			PERIPHERAL.REGISTER or PERIPHERAL.REGISTER.FIELD (with arrays
+#			under each of their registers' names)
+MAGIC = b'RKREGDB\0'
+VERSION = 1
+
+HEADER = struct.Struct ('<8sHH10I')
+PERIPHERAL = struct.Struct ('<IIQII')
+REGISTER = struct.Struct ('<IIHHIIQII')
+FIELD = struct.Struct ('<IIBBBx')
+SLOT = struct.Struct ('<IIIHH')
+
+NONE = 0xffffffff
+
+KIND_REGISTER = 0
+KIND_FIELD = 1
+
+ACCESS = [None, 'read-only', 'write-only', 'read-write', 'writeOnce', 'read-writeOnce']
+
+Peripheral = collections.namedtuple ('Peripheral', ['name', 'base_address', 'derived_from'])
+Register = collections.namedtuple ('Register', ['name', 'address', 'size', 'reset_value'])
+Field = collections.namedtuple ('Field', ['name', 'msb', 'lsb', 'access'])
+
+def name_hash (name):
+	# FNV-1a; python's own hash() is salted per process
+	h = 0x811c9dc5
+	for c in name.lower ().encode ('utf-8'):
+		h = ((h ^ c) * 0x01000193) & 0xffffffff
+
+	return h
+
+def dim_indexes (dim_index, dim):
+	# SVD dimIndex is either a range, "0-3", or a list, "A,B,C"
+	if dim_index is None:
+		return [str(i) for i in range(dim)]
+
+	m = re.match ('(\d+)-(\d+)$', dim_index)
+	if m:
+		return [str(i) for i in range(int(m.group(1)), int(m.group(2)) + 1)]
+
+	return dim_index.split (',')
+
+def parse_int (text):
+	text = text.strip ().lower ()
+	if text.startswith ('#'):
+		return int(text[1:], 2)
+
+	return int(text, 0)
+
+def bit_range (field):
+	if field.find ('bitRange') is not None:
+		m = re.match ('\[(\d+)\s*:\s*(\d+)\]', field.findtext ('bitRange'))
+		return (int(m.group(1)), int(m.group(2)))
+
+	if field.find ('lsb') is not None:
+		return (int(field.findtext ('msb')), int(field.findtext ('lsb')))
+
+	lsb = int(field.findtext ('bitOffset'))
+	return (lsb + int(field.findtext ('bitWidth')) - 1, lsb)
+
+class Writer (object):
+	def __init__ (self):
+		self.strings = {}
+		self.string_list = []
+		self.peripherals = []
+		self.registers = []
+		self.fields = []
+
+		# (key, kind, peripheral, record, element)
+		self.keys = []
+
+	def string (self, s):
+		if s is None:
+			return NONE
+
+		if s not in self.strings:
+			self.strings[s] = len(self.string_list)
+			self.string_list.append (s)
+
+		return self.strings[s]
+
+	def add_peripheral (self, p_xml, by_name):
+		name = p_xml.findtext ('name')
+		base = parse_int (p_xml.findtext ('baseAddress'))
+
+		derived = p_xml.get ('derivedFrom')
+		if derived is not None and p_xml.find ('registers') is None:
+			# same registers as the one it's derived from
+			(_, _, _, first, count) = self.peripherals[by_name[derived]]
+			derived = by_name[derived]
+		else:
+			derived = by_name[derived] if derived is not None else NONE
+			first = len(self.registers)
+			for reg in p_xml.iterfind ('registers/register'):
+				self.add_register (reg)
+
+			count = len(self.registers) - first
+
+		pidx = len(self.peripherals)
+		by_name[name] = pidx
+		self.peripherals.append ((self.string (name), derived, base, first, count))
+
+		for ridx in range(first, first + count):
+			(_, _, _, _, _, _, _, ffirst, fcount) = self.registers[ridx]
+			for (element, regname) in enumerate (self.register_names (ridx)):
+				self.keys.append ((name + '.' + regname, KIND_REGISTER, pidx, ridx, element))
+
+				for fidx in range(ffirst, ffirst + fcount):
+					fname = self.string_value (self.fields[fidx][0])
+					self.keys.append ((name + '.' + regname + '.' + fname, KIND_FIELD, pidx, fidx, element))
+
+	def add_register (self, reg):
+		size = reg.findtext ('size')
+		dim = reg.findtext ('dim')
+		reset = reg.findtext ('resetValue')
+
+		first = len(self.fields)
+		for field in reg.iterfind ('fields/field'):
+			(msb, lsb) = bit_range (field)
+			access = field.findtext ('access')
+			self.fields.append ((self.string (field.findtext ('name')), len(self.registers), msb, lsb, ACCESS.index (access)))
+
+		self.registers.append ((
+			self.string (reg.findtext ('name')),
+			parse_int (reg.findtext ('addressOffset')),
+			int(size, 0) if size is not None else 32,
+			int(dim, 0) if dim is not None else 0,
+			parse_int (reg.findtext ('dimIncrement')) if dim is not None else 0,
+			self.string (reg.findtext ('dimIndex')),
+			parse_int (reset) if reset is not None else 0,
+			first,
+			len(self.fields) - first
+		))
+
+	def string_value (self, sidx):
+		return self.string_list[sidx]
+
+	def register_names (self, ridx):
+		(name, _, _, dim, _, dim_index, _, _, _) = self.registers[ridx]
+		name = self.string_value (name)
+		if not dim:
+			return [name]
+
+		dim_index = self.string_value (dim_index) if dim_index != NONE else None
+		return [name.replace ('%s', i) for i in dim_indexes (dim_index, dim)]
+
+	def index (self):
+		# at most half full, so probes stay short
+		nslots = 1
+		while nslots < 2 * len(self.keys):
+			nslots *= 2
+
+		slots = [None] * nslots
+		for (key, kind, pidx, record, element) in self.keys:
+			h = name_hash (key)
+			i = h & (nslots - 1)
+			while slots[i] is not None:
+				i = (i + 1) & (nslots - 1)
+
+			slots[i] = (h, pidx + 1, record, element, kind)
+
+		return slots
+
+	def save (self, fname):
+		sections = []
+
+		blob = bytearray ()
+		offsets = []
+		for s in self.string_list:
+			offsets.append (len(blob))
+			blob += s.encode ('utf-8')
+
+		offsets.append (len(blob))
+		sections.append ((struct.pack ('<%dI' % len(offsets), *offsets) + bytes(blob), len(self.strings)))
+
+		for (st, rows) in ((PERIPHERAL, self.peripherals), (REGISTER, self.registers), (FIELD, self.fields)):
+			sections.append ((b''.join (st.pack (*row) for row in rows), len(rows)))
+
+		slots = self.index ()
+		empty = SLOT.pack (0, 0, 0, 0, 0)
+		sections.append ((b''.join (SLOT.pack (*slot) if slot else empty for slot in slots), len(slots)))
+
+		header = []
+		data = bytearray ()
+		offset = HEADER.size
+		for (section, count) in sections:
+			pad = -offset % 8
+			data += b'\0' * pad
+			offset += pad
+
+			header += [offset, count]
+			data += section
+			offset += len(section)
+
+		with open (fname + '.tmp', 'wb') as f:
+			f.write (HEADER.pack (MAGIC, VERSION, 0, *header))
+			f.write (data)
+
+		os.replace (fname + '.tmp', fname)
+
+def write (svd_fname, fname):
+	# a peripheral at a time, so we don't hold the whole SVD in memory
+	w = Writer ()
+	by_name = {}
+	for (event, p_xml) in ET.iterparse (svd_fname, tag='peripheral'):
+		w.add_peripheral (p_xml, by_name)
+
+		p_xml.clear ()
+		while p_xml.getprevious () is not None:
+			del p_xml.getparent ()[0]
+
+	w.save (fname)
+	return w
+
+class RegisterDB (object):
+	def __init__ (self, fname):
+		with open (fname, 'rb') as f:
+			self.mm = mmap.mmap (f.fileno (), 0, access=mmap.ACCESS_READ)
+
+		header = HEADER.unpack_from (self.mm, 0)
+		if header[0] != MAGIC:
+			raise ValueError ('%s is not a register database' % fname)
+
+		if header[1] != VERSION:
+			raise ValueError ('%s is version %d, not %d; regenerate it' % (fname, header[1], VERSION))
+
+		(self.strings, self.nstrings,
+			self.peripherals, self.nperipherals,
+			self.registers, self.nregisters,
+			self.fields, self.nfields,
+			self.slots, self.nslots) = header[3:]
+
+	def close (self):
+		self.mm.close ()
+
+	def __enter__ (self):
+		return self
+
+	def __exit__ (self, *exc):
+		self.close ()
+
+	def string (self, sidx):
+		if sidx == NONE:
+			return None
+
+		(start, end) = struct.unpack_from ('<II', self.mm, self.strings + 4 * sidx)
+		base = self.strings + 4 * (self.nstrings + 1)
+		return self.mm[base + start:base + end].decode ('utf-8')
+
+	def peripheral_row (self, pidx):
+		return PERIPHERAL.unpack_from (self.mm, self.peripherals + PERIPHERAL.size * pidx)
+
+	def register_row (self, ridx):
+		return REGISTER.unpack_from (self.mm, self.registers + REGISTER.size * ridx)
+
+	def field_row (self, fidx):
+		return FIELD.unpack_from (self.mm, self.fields + FIELD.size * fidx)
+
+	def register_name (self, row, element):
+		name = self.string (row[0])
+		if not row[3]:
+			return name
+
+		return name.replace ('%s', dim_indexes (self.string (row[5]), row[3])[element])
+
+	def slot_name (self, kind, pidx, record, element):
+		# the name a slot is for, to check a hash match against
+		pname = self.string (self.peripheral_row (pidx)[0])
+		if kind == KIND_REGISTER:
+			return pname + '.' + self.register_name (self.register_row (record), element)
+
+		(fname, ridx, _, _, _) = self.field_row (record)
+		return '%s.%s.%s' % (pname, self.register_name (self.register_row (ridx), element), self.string (fname))
+
+	def lookup (self, name):
+		# (kind, peripheral, record, element) for a name, case insensitively
+		h = name_hash (name)
+		i = h & (self.nslots - 1)
+		while True:
+			(slot_hash, pidx, record, element, kind) = SLOT.unpack_from (self.mm, self.slots + SLOT.size * i)
+			if pidx == 0:
+				raise KeyError (name)
+
+			if slot_hash == h and self.slot_name (kind, pidx - 1, record, element).lower () == name.lower ():
+				return (kind, pidx - 1, record, element)
+
+			i = (i + 1) & (self.nslots - 1)
+
+	def peripheral (self, name):
+		for pidx in range(self.nperipherals):
+			row = self.peripheral_row (pidx)
+			if self.string (row[0]).lower () == name.lower ():
+				derived = self.string (self.peripheral_row (row[1])[0]) if row[1] != NONE else None
+				return Peripheral (self.string (row[0]), row[2], derived)
+
+		raise KeyError (name)
+
+	def register (self, name):
+		(kind, pidx, ridx, element) = self.lookup (name)
+		if kind != KIND_REGISTER:
+			raise KeyError ('%s is a field' % name)
+
+		row = self.register_row (ridx)
+		address = self.peripheral_row (pidx)[2] + row[1] + element * row[4]
+		return Register (self.register_name (row, element), address, row[2], row[6])
+
+	def field (self, name):
+		(kind, pidx, fidx, element) = self.lookup (name)
+		if kind != KIND_FIELD:
+			raise KeyError ('%s is a register' % name)
+
+		(fname, _, msb, lsb, access) = self.field_row (fidx)
+		return Field (self.string (fname), msb, lsb, ACCESS[access])
+
+	def address (self, name):
+		# of a register, or of the register a field is in
+		if name.count ('.') == 2:
+			name = name.rsplit ('.', 1)[0]
+
+		return self.register (name).address
+
+	def bit_range (self, name):
+		f = self.field (name)
+		return (f.msb, f.lsb)
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print('usage: %s <svd> [<db>]        write a register database' % sys.argv[0])
+		print('       %s <db> <name>...      look up registers and fields' % sys.argv[0])
+		sys.exit (1)
+
+	if sys.argv[1].endswith ('.svd'):
+		fname = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext (sys.argv[1])[0] + '.regdb'
+		write (sys.argv[1], fname)
+		print('wrote', fname)
+		sys.exit (0)
+
+	with RegisterDB (sys.argv[1]) as db:
+		for name in sys.argv[2:]:
+			try:
+				if name.count ('.') == 2:
+					print(name, db.field (name), hex(db.address (name)))
+				else:
+					print(name, hex(db.address (name)))
+			except KeyError:
+				print(name, 'not found')